@@ -0,0 +1,305 @@
+import os, re, sys, json, time, random, resource, platform, threading, subprocess
+from contextlib import contextmanager
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+from PIL import Image
+from django.conf import settings
+from django.db import connection
+from django.test import override_settings
+from .image_cache import get_image_cache
+from .utils import ATOM_NS
+
+PRODUCT_ID_FORMAT = 'BENCH{:07d}'
+IMAGE_PATH = re.compile(r'^/images/(\d+)\.(\w+)$')
+IMAGE_FORMATS = {'jpeg': ('JPEG', 'jpg'), 'png': ('PNG', 'png'), 'webp': ('WEBP', 'webp')}
+
+
+def synthetic_image(size, image_format, seed):
+    """Encoded product photo stand-in with fractal detail, gradients and
+    light noise, so decoders and encoders do realistic work. PNGs are
+    noise-free cutouts with an alpha channel, like typical PNG packshots."""
+    random.seed(seed)
+    detail = Image.effect_mandelbrot(size, (-2.0 - random.random(), -1.2, 0.8, 1.2), 60)
+    gradient = Image.linear_gradient('L').resize(size)
+    mirrored = gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    if image_format == 'png':
+        image = Image.merge('RGBA', (detail, gradient, mirrored, Image.radial_gradient('L').resize(size)))
+    else:
+        noise = Image.effect_noise(size, random.uniform(8, 16))
+        image = Image.merge('RGB', (detail, gradient, Image.blend(mirrored, noise, 0.3)))
+
+    encoded = BytesIO()
+    image.save(encoded, format=IMAGE_FORMATS[image_format][0], quality=85)
+    return encoded.getvalue()
+
+
+def image_pool(sizes, formats):
+    """One encoded image per (size, format); products cycle through them."""
+    return [
+        (image_format, synthetic_image(size, image_format, seed=index))
+        for index, (size, image_format) in enumerate((s, f) for s in sizes for f in formats)
+    ]
+
+
+def synthetic_feed(base_url, products, pool):
+    """Atom feed of products with atom:id and atom:image_link, as the importer expects."""
+    lines = [f'<?xml version="1.0" encoding="UTF-8"?>\n<feed xmlns="{ATOM_NS}">']
+    for number in range(products):
+        extension = IMAGE_FORMATS[pool[number % len(pool)][0]][1]
+        lines.append(
+            f'<entry><id>{escape(PRODUCT_ID_FORMAT.format(number))}</id>'
+            f'<image_link>{escape(f"{base_url}/images/{number}.{extension}")}</image_link></entry>'
+        )
+    lines.append('</feed>')
+    return '\n'.join(lines).encode()
+
+
+class BenchmarkServer:
+    """Local HTTP stand-in for a supplier: serves the feed and product images
+    with latency seconds (+/- jitter) of delay per request. first_request
+    maps each product number to when (time.time()) its image was first
+    requested."""
+
+    def __init__(self, products, pool, latency=0.0, jitter=0.0):
+        self.products = products
+        self.pool = pool
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self.bytes_sent = 0
+        self.first_request = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_port}"
+        self.feed = synthetic_feed(self.base_url, products, pool)
+        self.feed_url = f"{self.base_url}/feed.xml"
+
+    def _handler(self):
+        bench = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                requested = time.time()
+                match = IMAGE_PATH.match(self.path)
+                if match:
+                    bench.first_request.setdefault(int(match.group(1)), requested)
+                body = bench.body_for(self.path)
+                if body is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                bench.delay()
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with bench._lock:
+                    bench.requests += 1
+                    bench.bytes_sent += len(body)
+
+        return Handler
+
+    def body_for(self, path):
+        if path == '/feed.xml':
+            return self.feed
+        match = IMAGE_PATH.match(path)
+        if match and int(match.group(1)) < self.products:
+            return self.pool[int(match.group(1)) % len(self.pool)][1]
+        return None
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, name='benchmark-server', daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def synthetic_frame(path, size=(1200, 1200)):
+    """Frame template with a transparent window in the middle."""
+    frame = Image.new('RGBA', size, (30, 90, 160, 255))
+    window = Image.new('RGBA', (size[0] - 200, size[1] - 200), (0, 0, 0, 0))
+    frame.paste(window, (100, 100))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    frame.save(path)
+
+
+@contextmanager
+def scratch_environment(tmp, **overrides):
+    """Run offline renders against throwaway media, feed and image caches
+    under tmp, with a local cache and channel layer, so they neither touch
+    production files nor need Redis. Yields the scratch image cache, which
+    fetch_image also uses by default while the settings are overridden."""
+    with override_settings(
+        MEDIA_ROOT=os.path.join(tmp, 'media'),
+        FEED_CACHE_DIR=os.path.join(tmp, 'feed_cache'),
+        IMAGE_CACHE_DIR=os.path.join(tmp, 'image_cache'),
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+        **overrides,
+    ):
+        yield get_image_cache()
+
+
+@contextmanager
+def scratch_database(tmp):
+    """Switch the default database to a new, migrated test database for the
+    duration, so task-path runs write real rows without touching the real
+    ones; it is destroyed afterwards. On SQLite it is a file under tmp (the
+    render threads need their own connections to it); elsewhere it is
+    Django's test database, which needs the CREATE DATABASE privilege."""
+    old_name = connection.settings_dict['NAME']
+    old_test = connection.settings_dict['TEST']
+    if connection.vendor == 'sqlite':
+        connection.settings_dict['TEST'] = {**old_test, 'NAME': os.path.join(tmp, 'scratch.sqlite3')}
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        connection.settings_dict['TEST'] = old_test
+
+
+class DiscardOutputs:
+    """OutputBuffer stand-in for scratch runs: counts the OutputImage rows
+    a run produces instead of writing them, so scratch frames never need to
+    exist in the database."""
+
+    def __init__(self):
+        self.rows = 0
+
+    def add_rendered(self, output):
+        self.rows += 1
+
+    add_failed = add_refreshed = add_rendered
+
+    def flush(self):
+        pass
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def child_pids(parent):
+    """Live child processes of parent, from /proc (Linux only)."""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The parent pid follows the state, after the parenthesised command name
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        if ppid == parent:
+            pids.append(int(entry))
+    return pids
+
+
+def rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+class ChildrenRSS:
+    """Samples the summed resident memory of this process's children (the
+    render pool) every interval seconds while active. getrusage's
+    RUSAGE_CHILDREN only covers children that have exited and been reaped,
+    so it misses a pool that is still running. peak_mb is None where /proc
+    is not available."""
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak_kb = 0
+        self.supported = os.path.isdir('/proc')
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def __enter__(self):
+        if self.supported:
+            self._sampler = threading.Thread(target=self._sample, name='rss-sampler', daemon=True)
+            self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+
+    def _sample(self):
+        parent = os.getpid()
+        while True:
+            self.peak_kb = max(self.peak_kb, sum(rss_kb(pid) for pid in child_pids(parent)))
+            if self._stop.wait(self.interval):
+                return
+
+    @property
+    def peak_mb(self):
+        return round(self.peak_kb / 1024, 1) if self.supported else None
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def run_record(params, results):
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'params': params,
+        'results': results,
+    }
+
+
+def append_record(path, record):
+    """Append a run to a JSON Lines file and return the previous run with
+    the same params (None if there is none)."""
+    previous = None
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    earlier = json.loads(line)
+                except ValueError:
+                    continue
+                if earlier.get('params') == record['params']:
+                    previous = earlier
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a') as f:
+        f.write(json.dumps(record, sort_keys=True) + '\n')
+    return previous
@@ -1,6 +1,8 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.core.cache import cache
+from .progress import snapshot_key
 
 class ProgressConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -29,6 +31,11 @@ class ProgressConsumer(AsyncWebsocketConsumer):
         )
         await self.accept()
 
+        # Late joiners get the latest progress snapshot right away
+        snapshot = await cache.aget(snapshot_key(self.frame_id))
+        if snapshot:
+            await self.send(text_data=json.dumps(snapshot))
+
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(
             self.group_name,
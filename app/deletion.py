@@ -0,0 +1,59 @@
+import os, shutil, logging
+from django.conf import settings
+from .listing import search_outputs
+from .models import OutputImage
+
+logger = logging.getLogger(__name__)
+
+
+def remove_media_file(name):
+    if not name:
+        return
+    try:
+        os.remove(os.path.join(settings.MEDIA_ROOT, name))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Could not remove {name}: {e}")
+
+
+def remove_output_dir(frame_id):
+    """Drop a frame's whole outputs directory (renders and thumbnails) in one pass."""
+    shutil.rmtree(os.path.join(settings.MEDIA_ROOT, 'outputs', str(frame_id)), ignore_errors=True)
+
+
+def selected_outputs(frame_id, output_ids=None, search_value=''):
+    """Outputs of a frame picked by id list and/or the outputs table search."""
+    outputs = OutputImage.objects.filter(frame_id=frame_id)
+    if output_ids is not None:
+        outputs = outputs.filter(id__in=output_ids)
+    return search_outputs(outputs, search_value)
+
+
+def delete_outputs(outputs, on_progress=None, batch_size=None, remove_files=True):
+    """Delete a queryset of outputs and their files, batch by batch.
+
+    Only ids and file names are loaded, and each batch is removed with a
+    single DELETE, so neither memory nor lock time grows with the number of
+    outputs. on_progress(deleted) is called after every batch. With
+    remove_files=False only the rows are deleted, e.g. after
+    remove_output_dir already dropped the files. Returns the number of
+    deleted outputs.
+    """
+    batch_size = batch_size or settings.DELETE_BATCH_SIZE
+    fields = ('id', 'image', 'thumbnail') if remove_files else ('id',)
+    outputs = outputs.order_by().values_list(*fields)
+    deleted = 0
+    while True:
+        rows = list(outputs[:batch_size])
+        if not rows:
+            break
+        if remove_files:
+            for _, image, thumbnail in rows:
+                remove_media_file(image)
+                remove_media_file(thumbnail)
+        OutputImage.objects.filter(id__in=[row[0] for row in rows]).delete()
+        deleted += len(rows)
+        if on_progress:
+            on_progress(deleted)
+    return deleted
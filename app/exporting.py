@@ -0,0 +1,78 @@
+import os, zipfile, logging
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Read size for copying output files into the archive
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+class ZipSink:
+    """Write-only file object collecting what ZipFile writes until drained.
+
+    It has no tell()/seek(), so ZipFile writes data descriptors after each
+    entry instead of seeking back to patch the local headers.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(files):
+    """Stream a ZIP of (path, arcname) pairs as byte chunks.
+
+    Entries are stored uncompressed (outputs are PNG/WebP/JPEG already) and
+    copied in EXPORT_CHUNK_SIZE blocks, so memory stays constant whatever the
+    number of files. Files that disappeared since they were listed are
+    skipped.
+    """
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for path, arcname in files:
+            try:
+                source = open(path, 'rb')
+            except OSError as e:
+                logger.warning(f"Skipping {path} in export: {e}")
+                continue
+            with source:
+                info = zipfile.ZipInfo.from_file(path, arcname)
+                info.compress_type = zipfile.ZIP_STORED
+                with archive.open(info, 'w') as entry:
+                    for block in iter(lambda: source.read(EXPORT_CHUNK_SIZE), b''):
+                        entry.write(block)
+                        yield sink.drain()
+            data = sink.drain()
+            if data:
+                yield data
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def export_files(outputs):
+    """(path, arcname) pairs for a queryset of rendered outputs, read in batches."""
+    for image in outputs.values_list('image', flat=True).iterator(chunk_size=2000):
+        yield os.path.join(settings.MEDIA_ROOT, image), os.path.basename(image)
+
+
+def export_parts(total):
+    """Number of ZIP parts an export of total outputs is split into."""
+    size = settings.ZIP_EXPORT_PART_SIZE
+    if not size or total <= size:
+        return 1
+    return (total + size - 1) // size
@@ -0,0 +1,221 @@
+import time, random, threading, logging
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class HostUnavailable(requests.ConnectionError):
+    """Raised without a request while a host's circuit breaker is open."""
+
+
+class ResponseTooLarge(requests.RequestException):
+    """Raised when a response body exceeds the caller's byte cap."""
+
+
+class RateLimiter:
+    """Token bucket allowing rate requests per second with bursts of burst."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """Stops requests to a host after threshold consecutive failures.
+
+    While open, requests fail immediately with HostUnavailable. After
+    reset_seconds a single probe request is let through; its success closes
+    the breaker, its failure opens it for another reset_seconds.
+    """
+
+    def __init__(self, host, threshold, reset_seconds):
+        self.host = host
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit for {self.host} closed again")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+                logger.warning(f"Circuit for {self.host} opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+
+_session = None
+_session_lock = threading.Lock()
+_per_host = {}
+_per_host_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide keep-alive session shared by all fetch threads."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=settings.IMAGE_FETCH_CONCURRENCY,
+                    pool_maxsize=settings.IMAGE_FETCH_CONCURRENCY,
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def per_host(kind, url, factory):
+    host = urlsplit(url).netloc
+    with _per_host_lock:
+        value = _per_host.get((kind, host))
+        if value is None:
+            value = _per_host[(kind, host)] = factory(host)
+    return value
+
+
+def host_slot(url):
+    """Semaphore capping concurrent connections to a single host."""
+    return per_host('slot', url, lambda host: threading.BoundedSemaphore(settings.IMAGE_FETCH_PER_HOST))
+
+
+def host_rate(url):
+    return per_host('rate', url, lambda host: RateLimiter(settings.IMAGE_FETCH_RATE, settings.IMAGE_FETCH_BURST))
+
+
+def host_breaker(url):
+    return per_host('breaker', url, lambda host: CircuitBreaker(
+        host, settings.FETCH_CIRCUIT_THRESHOLD, settings.FETCH_CIRCUIT_RESET_SECONDS
+    ))
+
+
+def fetch_timeout():
+    return (settings.IMAGE_FETCH_CONNECT_TIMEOUT, settings.IMAGE_FETCH_READ_TIMEOUT)
+
+
+def retry_delay(attempt, response=None):
+    """Exponential backoff with full jitter, stretched to honour Retry-After."""
+    delay = random.uniform(0, min(settings.FETCH_BACKOFF_MAX, settings.FETCH_BACKOFF_BASE * 2 ** attempt))
+    retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+    if retry_after.isdigit():
+        delay = max(delay, int(retry_after))
+    return min(delay, settings.FETCH_BACKOFF_MAX)
+
+
+def policy_get(url, headers=None, stream=False, max_bytes=None):
+    """GET url under the outbound fetch policy.
+
+    Requests to one host are capped at IMAGE_FETCH_PER_HOST in flight and
+    IMAGE_FETCH_RATE per second (per worker process). Connection errors,
+    timeouts, 429 and 5xx answers are retried up to FETCH_RETRIES times with
+    backoff; the host's circuit breaker counts them. Other responses,
+    including errors, are returned to the caller as is.
+
+    With max_bytes the body is streamed in under the same host slot and
+    retries (a transfer dropped halfway is retried) and capped with
+    ResponseTooLarge; it is then available as response.content.
+    """
+    breaker = host_breaker(url)
+    for attempt in range(settings.FETCH_RETRIES + 1):
+        if not breaker.allow():
+            raise HostUnavailable(f"{urlsplit(url).netloc} is unavailable, skipping {url}")
+
+        response = None
+        error = None
+        with host_slot(url):
+            if settings.IMAGE_FETCH_RATE:
+                host_rate(url).acquire()
+            try:
+                response = get_session().get(
+                    url, headers=headers, stream=stream or max_bytes is not None, timeout=fetch_timeout()
+                )
+                if max_bytes is not None and response.status_code not in RETRY_STATUSES:
+                    response._content = read_limited(response, max_bytes)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                error = e
+            except ResponseTooLarge:
+                response.close()
+                raise
+
+        if error is None and response.status_code not in RETRY_STATUSES:
+            breaker.record_success()
+            return response
+        if error is None and response.status_code == 429:
+            # A throttling host is alive; only errors count towards opening the circuit
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        if attempt == settings.FETCH_RETRIES:
+            if error is not None:
+                raise error
+            return response
+
+        delay = retry_delay(attempt, response)
+        reason = error or f"HTTP {response.status_code}"
+        logger.info(f"Retrying {url} in {delay:.1f}s after {reason}")
+        if response is not None:
+            response.close()
+        time.sleep(delay)
+
+
+def iter_limited(response, max_bytes, chunk_size=64 * 1024):
+    """Yield a streamed response body, raising ResponseTooLarge as soon as it
+    exceeds max_bytes (0 = no cap).
+
+    A Content-Length over the cap fails before anything is read; the running
+    count also covers bodies without one and decompressed gzip bodies.
+    """
+    length = response.headers.get('Content-Length', '')
+    if max_bytes and length.isdigit() and int(length) > max_bytes:
+        raise ResponseTooLarge(f"{response.url} is {length} bytes, over the {max_bytes} byte limit")
+    received = 0
+    for chunk in response.iter_content(chunk_size):
+        received += len(chunk)
+        if max_bytes and received > max_bytes:
+            raise ResponseTooLarge(f"{response.url} exceeded the {max_bytes} byte limit")
+        yield chunk
+
+
+def read_limited(response, max_bytes):
+    return b''.join(iter_limited(response, max_bytes))
@@ -0,0 +1,151 @@
+import logging, hashlib
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from .image_cache import get_image_cache
+from .fetch_policy import policy_get
+
+logger = logging.getLogger(__name__)
+
+# content is None when the server answered 304 Not Modified; cached is True
+# when the image came from the image cache without downloading its body
+FetchResult = namedtuple(
+    'FetchResult', ['content', 'etag', 'last_modified', 'content_hash', 'not_modified', 'cached'],
+    defaults=(False,),
+)
+
+def fetch_bytes(url):
+    return fetch_image(url).content
+
+
+def cached_result(cache, entry, not_modified):
+    if not_modified:
+        return FetchResult(None, entry['etag'], entry['last_modified'], entry['hash'], True, True)
+    content = cache.read(entry)
+    if content is None:
+        return None
+    return FetchResult(content, entry['etag'], entry['last_modified'], entry['hash'], False, True)
+
+
+def download_image(url, headers=None):
+    """GET capped at IMAGE_MAX_BYTES; returns (response, body), with body
+    None for 304 Not Modified."""
+    response = policy_get(url, headers, max_bytes=settings.IMAGE_MAX_BYTES)
+    if response.status_code == 304:
+        return response, None
+    response.raise_for_status()
+    return response, response.content
+
+
+def fetch_image(url, etag='', last_modified='', cache=None):
+    """Fetch a product image through the shared on-disk image cache (or
+    the given ImageCache).
+
+    Cached copies checked within IMAGE_CACHE_FRESH_SECONDS are used without
+    touching the network; older ones are revalidated with a conditional GET.
+    The caller's own validators (from its last render) are used when the
+    URL is not cached. not_modified is reported when the caller's validators
+    still describe the current image, in which case content is None.
+    """
+    cache = cache or get_image_cache()
+    entry = cache.lookup(url) if cache.enabled else None
+    if entry is not None:
+        unchanged = bool(etag or last_modified) and (etag, last_modified) == (entry['etag'], entry['last_modified'])
+        if cache.is_fresh(entry):
+            result = cached_result(cache, entry, unchanged)
+            if result is not None:
+                return result
+        etag, last_modified = entry['etag'], entry['last_modified']
+
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    # Timeouts, retries, rate limits and the circuit breaker live in fetch_policy
+    response, content = download_image(url, headers)
+    if content is None:
+        if entry is None:
+            return FetchResult(None, etag, last_modified, '', True)
+        cache.mark_checked(url, entry)
+        result = cached_result(cache, entry, unchanged)
+        if result is not None:
+            return result
+        # Blob evicted under us: fetch it again unconditionally
+        response, content = download_image(url)
+        content = content or b''
+
+    result = FetchResult(
+        content,
+        response.headers.get('ETag', ''),
+        response.headers.get('Last-Modified', ''),
+        hashlib.sha256(content).hexdigest(),
+        False,
+    )
+    if cache.enabled:
+        try:
+            cache.store(url, content, result.etag, result.last_modified, result.content_hash)
+        except OSError as e:
+            logger.warning(f"Could not cache image {url}: {e}")
+    return result
+
+
+def timed_fetch(metrics, url, etag='', last_modified='', cache=None):
+    """fetch_image, recording its time, downloaded bytes and cache hits in metrics."""
+    with metrics.timer('fetch'):
+        result = fetch_image(url, etag, last_modified, cache)
+    if result.cached:
+        metrics.count('image_cache_hits')
+    elif result.content is not None:
+        metrics.count('images_downloaded')
+        metrics.count('bytes_fetched', len(result.content))
+    if result.not_modified:
+        metrics.count('images_not_modified')
+    return result
+
+
+def prefetch_images(entries, validators=None, max_workers=None, metrics=None, cache=None, budget=None):
+    """Download product images ahead of the consumer.
+
+    Yields (product_id, image_link, download) in feed order, where download
+    is a Future holding a FetchResult; calling download.result() re-raises
+    any fetch error. validators maps product_id to (etag, last_modified) for
+    conditional requests. At most 2 * max_workers downloads are queued at
+    once so memory stays bounded while fetching overlaps with compositing;
+    while budget (a MemoryBudget) is exhausted only one is queued, since the
+    renders could not take more bodies anyway.
+    Fetch timings and byte counts go to metrics (a RenderMetrics) if given;
+    cache replaces the shared image cache.
+    """
+    validators = validators or {}
+    max_workers = max_workers or settings.IMAGE_FETCH_CONCURRENCY
+    entries = iter(entries)
+    pending = deque()
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-fetch')
+    try:
+        def submit_next():
+            for product_id, image_link in entries:
+                etag, last_modified = validators.get(product_id, ('', ''))
+                if metrics is None:
+                    download = executor.submit(fetch_image, image_link, etag, last_modified, cache)
+                else:
+                    download = executor.submit(timed_fetch, metrics, image_link, etag, last_modified, cache)
+                pending.append((product_id, image_link, download))
+                return True
+            return False
+
+        def fill():
+            window = 1 if budget is not None and budget.exhausted() else max_workers * 2
+            while len(pending) < window and submit_next():
+                pass
+
+        fill()
+        while pending:
+            product_id, image_link, download = pending.popleft()
+            fill()
+            yield product_id, image_link, download
+    finally:
+        # A consumer that stops early must not wait for the queued downloads
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -6,7 +6,8 @@ from .models import Frame
 class AddFrameForm(forms.ModelForm):
     class Meta:
         model = Frame
-        fields = ['name', 'xmlFeedPath', 'image']
+        fields = ['name', 'xmlFeedPath', 'image', 'output_format', 'output_quality',
+                  'png_compress_level', 'png_optimize', 'resample_mode', 'render_mode']
         widgets = {
             'name': forms.TextInput(attrs={
                 'class': 'form-control',
@@ -19,22 +20,57 @@ class AddFrameForm(forms.ModelForm):
             'image': forms.ClearableFileInput(attrs={
                 'class': 'form-control'
             }),
+            'output_format': forms.Select(attrs={
+                'class': 'form-select'
+            }),
+            'output_quality': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'min': 1,
+                'max': 100
+            }),
+            'png_compress_level': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'min': 0,
+                'max': 9
+            }),
+            'png_optimize': forms.CheckboxInput(attrs={
+                'class': 'form-check-input'
+            }),
+            'resample_mode': forms.Select(attrs={
+                'class': 'form-select'
+            }),
+            'render_mode': forms.Select(attrs={
+                'class': 'form-select'
+            }),
         }
         labels = {
             'name': 'Frame Name',
             'xmlFeedPath': 'XML Feed URL',
-            'image': 'Frame Template Image'
+            'image': 'Frame Template Image',
+            'output_format': 'Output Format',
+            'output_quality': 'Output Quality',
+            'png_compress_level': 'PNG Compression Level',
+            'png_optimize': 'Optimize PNG',
+            'resample_mode': 'Resize Quality',
+            'render_mode': 'Rendering'
         }
         help_texts = {
             'name': 'Choose a descriptive name for your frame project',
             'xmlFeedPath': 'Provide a valid XML feed URL containing product information',
-            'image': 'Upload a high-quality frame template image (JPG/PNG)'
+            'image': 'Upload a high-quality frame template image (JPG/PNG)',
+            'output_format': 'WebP and JPEG produce much smaller files; JPEG flattens transparency onto white',
+            'output_quality': 'Quality for WebP/JPEG outputs (1-100)',
+            'png_compress_level': 'PNG only: 0 is fastest, 9 is smallest',
+            'png_optimize': 'PNG only: extra pass for smaller files at higher encode cost',
+            'resample_mode': 'Trade product image sharpness for rendering speed',
+            'render_mode': 'Lazy mode goes live instantly and renders each product when it is first requested'
         }
 
 class EditFrameForm(forms.ModelForm):
     class Meta:
         model = Frame
-        fields = ['name', 'xmlFeedPath', 'image']
+        fields = ['name', 'xmlFeedPath', 'image', 'output_format', 'output_quality',
+                  'png_compress_level', 'png_optimize', 'resample_mode', 'render_mode']
         widgets = {
             'name': forms.TextInput(attrs={
                 'class': 'form-control',
@@ -47,16 +83,50 @@ class EditFrameForm(forms.ModelForm):
             'image': forms.ClearableFileInput(attrs={
                 'class': 'form-control'
             }),
+            'output_format': forms.Select(attrs={
+                'class': 'form-select'
+            }),
+            'output_quality': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'min': 1,
+                'max': 100
+            }),
+            'png_compress_level': forms.NumberInput(attrs={
+                'class': 'form-control',
+                'min': 0,
+                'max': 9
+            }),
+            'png_optimize': forms.CheckboxInput(attrs={
+                'class': 'form-check-input'
+            }),
+            'resample_mode': forms.Select(attrs={
+                'class': 'form-select'
+            }),
+            'render_mode': forms.Select(attrs={
+                'class': 'form-select'
+            }),
         }
         labels = {
             'name': 'Frame Name',
             'xmlFeedPath': 'XML Feed URL',
-            'image': 'Frame Template Image'
+            'image': 'Frame Template Image',
+            'output_format': 'Output Format',
+            'output_quality': 'Output Quality',
+            'png_compress_level': 'PNG Compression Level',
+            'png_optimize': 'Optimize PNG',
+            'resample_mode': 'Resize Quality',
+            'render_mode': 'Rendering'
         }
         help_texts = {
             'name': 'Update the frame project name',
             'xmlFeedPath': 'Update the XML feed URL (this won\'t affect existing outputs)',
-            'image': 'Replace frame template (will require re-setting coordinates)'
+            'image': 'Replace frame template (will require re-setting coordinates)',
+            'output_format': 'Applies to outputs generated from now on',
+            'output_quality': 'Quality for WebP/JPEG outputs (1-100)',
+            'png_compress_level': 'PNG only: 0 is fastest, 9 is smallest',
+            'png_optimize': 'PNG only: extra pass for smaller files at higher encode cost',
+            'resample_mode': 'Trade product image sharpness for rendering speed',
+            'render_mode': 'Lazy mode goes live instantly and renders each product when it is first requested'
         }
 
 class CustomUserCreationForm(UserCreationForm):
@@ -0,0 +1,207 @@
+import os, json, time, hashlib, tempfile, threading, logging
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache:
+    """Content-addressed on-disk cache of product image bytes.
+
+    Lives on the media volume so web and all workers share it. Each URL has
+    a small JSON index entry (content hash, ETag, Last-Modified, last check
+    time); image bytes are stored once per content hash in a sharded blob
+    tree, so the same picture behind several URLs is kept only once. Blob
+    mtimes are bumped on every read. The total blob size is tracked in the
+    Django cache as blobs are added; once it passes max_bytes the least
+    recently used blobs and their index entries are evicted in a background
+    thread, one process at a time.
+    """
+
+    # Evict down to this fraction of max_bytes so eviction doesn't run on every write
+    LOW_WATER = 0.9
+    # Upper bound on one eviction pass; a crashed evictor's lock expires after it
+    EVICT_LOCK_SECONDS = 600
+
+    def __init__(self, root, max_bytes, fresh_seconds):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.fresh_seconds = fresh_seconds
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _index_path(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.root, 'index', key[:2], f'{key}.json')
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, 'blobs', digest[:2], digest[2:4], digest)
+
+    def lookup(self, url):
+        """Return the index entry for url, or None if it (or its blob) is missing."""
+        try:
+            with open(self._index_path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('url') != url or not os.path.exists(self._blob_path(entry['hash'])):
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        return time.time() - entry.get('checked_at', 0) < self.fresh_seconds
+
+    def read(self, entry):
+        """Return the cached bytes (None if evicted meanwhile) and mark them used."""
+        path = self._blob_path(entry['hash'])
+        try:
+            with open(path, 'rb') as f:
+                content = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return content
+
+    def mark_checked(self, url, entry):
+        entry['checked_at'] = time.time()
+        self._write_json(self._index_path(url), entry)
+
+    def store(self, url, content, etag, last_modified, digest=None):
+        digest = digest or hashlib.sha256(content).hexdigest()
+        blob_path = self._blob_path(digest)
+        added = not os.path.exists(blob_path)
+        if added:
+            self._write_file(blob_path, content)
+        else:
+            os.utime(blob_path)
+        self._write_json(self._index_path(url), {
+            'url': url,
+            'hash': digest,
+            'etag': etag,
+            'last_modified': last_modified,
+            'checked_at': time.time(),
+        })
+
+        if added:
+            self._added(len(content))
+        return digest
+
+    def _key(self, name):
+        # Several caches (e.g. scratch runs) may share the Django cache
+        root = hashlib.sha256(self.root.encode()).hexdigest()[:16]
+        return f"image_cache_{name}_{root}"
+
+    def _added(self, size):
+        try:
+            total = cache.incr(self._key('bytes'), size)
+        except ValueError:
+            # Not tracked yet, or the Django cache was cleared: a scan sets it
+            total = None
+        if total is None or total > self.max_bytes:
+            self.schedule_eviction()
+
+    def schedule_eviction(self):
+        """Run evict() in a background thread, unless a thread of this or
+        another process is already evicting."""
+        if not cache.add(self._key('evicting'), 1, self.EVICT_LOCK_SECONDS):
+            return
+        threading.Thread(target=self._evict_locked, name='image-cache-evict', daemon=True).start()
+
+    def _evict_locked(self):
+        try:
+            self.evict()
+        except Exception as e:
+            logger.error(f"Image cache eviction failed: {e}")
+        finally:
+            cache.delete(self._key('evicting'))
+
+    def evict(self):
+        """Delete least recently used blobs until the cache fits the budget,
+        together with the index entries pointing at them, and reset the
+        tracked size to what is left."""
+        size_key = self._key('bytes')
+        tracked_before = cache.get(size_key) or 0
+        blobs = []
+        total = 0
+        for dirpath, _, filenames in os.walk(os.path.join(self.root, 'blobs')):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                blobs.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        removed = 0
+        if total > self.max_bytes:
+            target = self.max_bytes * self.LOW_WATER
+            blobs.sort()
+            for _, size, path in blobs:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            pruned = self._prune_index()
+            logger.info(
+                f"Image cache eviction removed {removed} blobs and {pruned} index entries, "
+                f"{total} bytes remain"
+            )
+        # Blobs stored while scanning were counted on top of tracked_before
+        stored_meanwhile = max(0, (cache.get(size_key) or 0) - tracked_before)
+        cache.set(size_key, total + stored_meanwhile, None)
+
+    def _prune_index(self):
+        """Remove index entries whose blob is gone; returns how many."""
+        pruned = 0
+        for dirpath, _, filenames in os.walk(os.path.join(self.root, 'index')):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    with open(path) as f:
+                        digest = json.load(f)['hash']
+                except (OSError, ValueError, KeyError, TypeError):
+                    digest = None
+                if digest is not None and os.path.exists(self._blob_path(digest)):
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                pruned += 1
+        return pruned
+
+    def _write_file(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _write_json(self, path, data):
+        self._write_file(path, json.dumps(data).encode())
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_image_cache():
+    """The shared ImageCache for the current IMAGE_CACHE_* settings, so a
+    scratch run with its own IMAGE_CACHE_DIR also gets its own cache."""
+    key = (settings.IMAGE_CACHE_DIR, settings.IMAGE_CACHE_MAX_BYTES, settings.IMAGE_CACHE_FRESH_SECONDS)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = ImageCache(*key)
+        return _caches[key]
@@ -0,0 +1,274 @@
+import time, hashlib, logging
+from datetime import timedelta
+from celery import current_app, states
+from celery.result import AsyncResult
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .models import ProcessingJob
+from .metrics import RenderMetrics
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED = 'queued', 'running', 'completed', 'failed', 'cancelled'
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# Cancel flags outlive any run
+CANCEL_TIMEOUT = 60 * 60 * 24
+
+# Rendering chunks keep refreshing this lease; deleting a frame waits until
+# the lease of its last (cancelled) run has expired
+RENDER_LEASE_SECONDS = 60
+
+
+def cancel_key(job_id):
+    return f"job_cancelled_{job_id}"
+
+
+def rendering_key(frame_id):
+    return f"frame_rendering_{frame_id}"
+
+
+def mark_rendering(frame_id):
+    cache.set(rendering_key(frame_id), 1, RENDER_LEASE_SECONDS)
+
+
+def is_rendering(frame_id):
+    """Whether a chunk of the frame may still be writing outputs."""
+    return cache.get(rendering_key(frame_id)) is not None
+
+
+def active_job(frame):
+    return frame.jobs.filter(status__in=ACTIVE_STATUSES).first()
+
+
+def run_task_id(job_id, attempt):
+    """Task id of the coordinator dispatched after the job's attempt-th attempt."""
+    return f"render_run_{job_id}_{attempt}"
+
+
+def chunk_task_id(job_id, attempt, chunk_index):
+    return f"render_chunk_{job_id}_{attempt}_{chunk_index}"
+
+
+def result_expiry():
+    expires = current_app.conf.result_expires
+    if expires is None or isinstance(expires, timedelta):
+        return expires
+    return timedelta(seconds=expires)
+
+
+def waiting_for_worker(job):
+    """Whether the job's coordinator (queued job) or one of its unfinished
+    chunks (running job) is still in the broker, not yet taken by a worker.
+
+    The tasks report STARTED (track_started), so a PENDING result means the
+    task has not begun; a task that died in a worker stays STARTED. Results
+    that may have expired are not trusted, and without a result backend this
+    is always False.
+    """
+    expires = result_expiry()
+    if expires is not None and timezone.now() - job.updated_at > expires:
+        return False
+    if job.status == QUEUED:
+        task_ids = [run_task_id(job.id, job.attempt)]
+    else:
+        done = set(job.done_chunks)
+        task_ids = [
+            chunk_task_id(job.id, job.attempt, index)
+            for index in range(job.dispatched_chunks) if index not in done
+        ]
+    try:
+        return any(AsyncResult(task_id).state == states.PENDING for task_id in task_ids)
+    except Exception as e:
+        logger.warning(f"Could not read the task states of job {job.id}: {e}")
+        return False
+
+
+def is_stale(job):
+    """An active job whose heartbeat stopped, e.g. because its worker died.
+    A job whose tasks are queued behind other work is not stale, however
+    long they wait."""
+    return (
+        job.status in ACTIVE_STATUSES
+        and timezone.now() - job.updated_at > timedelta(seconds=settings.JOB_STALE_SECONDS)
+        and not waiting_for_worker(job)
+    )
+
+
+def is_resumable(job):
+    return job.status in (FAILED, CANCELLED) or is_stale(job)
+
+
+def start_job(frame, incremental=True):
+    """Take the frame's run lock by creating a queued job.
+
+    Returns (job, True) on success, or (active job, False) when another
+    run already holds the lock.
+    """
+    try:
+        with transaction.atomic():
+            return ProcessingJob.objects.create(frame=frame, incremental=incremental), True
+    except IntegrityError:
+        return active_job(frame), False
+
+
+def claim_job(job):
+    """Queue an interrupted job again. Returns False if another caller
+    claimed it first or another run of the frame is active."""
+    try:
+        with transaction.atomic():
+            claimed = ProcessingJob.objects.filter(
+                id=job.id, status=job.status, updated_at=job.updated_at
+            ).update(status=QUEUED, error='', finished_at=None, updated_at=timezone.now())
+    except IntegrityError:
+        return False
+    if claimed:
+        cache.delete(cancel_key(job.id))
+    return bool(claimed)
+
+
+def feed_hash(chunks):
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        for product_id, _ in chunk:
+            digest.update(product_id.encode())
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def begin_attempt(job, chunks, chunk_size, render_hash, metrics=None):
+    """Mark job running for a new attempt and return the chunk indexes
+    that still need rendering.
+
+    The chunks an earlier attempt finished are kept only if the feed lists
+    the same products in the same order and the frame's render inputs are
+    unchanged; otherwise the job starts over. metrics (e.g. the feed
+    download time) are added to the job's run summary.
+    """
+    layout = feed_hash(chunks)
+    resumable = (
+        job.done_chunks
+        and job.chunk_size == chunk_size
+        and job.feed_hash == layout
+        and job.render_hash == render_hash
+    )
+    if not resumable:
+        job.done_chunks = []
+        job.checkpoint = job.processed = job.skipped = job.failed = 0
+        job.metrics = {}
+    elif job.attempt:
+        logger.info(f"Resuming job {job.id} from entry {job.checkpoint} ({len(job.done_chunks)} chunks done)")
+
+    job.status = RUNNING
+    job.attempt += 1
+    job.chunk_size = chunk_size
+    job.dispatched_chunks = 0
+    job.feed_hash = layout
+    job.render_hash = render_hash
+    job.total = sum(len(chunk) for chunk in chunks)
+    if metrics:
+        job.metrics = merge_metrics(job.metrics, metrics)
+    job.save()
+
+    done = set(job.done_chunks)
+    return [index for index in range(len(chunks)) if index not in done]
+
+
+def merge_metrics(summary, metrics):
+    combined = RenderMetrics(summary)
+    combined.merge(metrics)
+    return combined.as_dict()
+
+
+def record_chunk(job_id, attempt, chunk_index, counts):
+    """Add a finished chunk to the job's counters, run metrics and checkpoint."""
+    with transaction.atomic():
+        job = ProcessingJob.objects.select_for_update().get(id=job_id)
+        if job.attempt != attempt or job.status != RUNNING or chunk_index in job.done_chunks:
+            return job
+        job.done_chunks.append(chunk_index)
+        job.processed += counts['processed']
+        job.skipped += counts['skipped']
+        job.failed += counts['failed']
+        job.metrics = merge_metrics(job.metrics, counts.get('metrics', {}))
+
+        done = set(job.done_chunks)
+        contiguous = job.checkpoint // job.chunk_size if job.chunk_size else 0
+        while contiguous in done:
+            contiguous += 1
+        job.checkpoint = min(contiguous * job.chunk_size, job.total)
+        job.save()
+    return job
+
+
+def heartbeat(job_id, attempt):
+    """Mark the attempt alive; returns False once it is no longer the job's
+    running attempt (cancelled, failed or superseded by a resume)."""
+    return bool(ProcessingJob.objects.filter(id=job_id, attempt=attempt, status=RUNNING).update(
+        updated_at=timezone.now()
+    ))
+
+
+def finish_job(job_id, attempt, status, error=''):
+    """Close a running job; returns False if it was cancelled or superseded."""
+    return bool(ProcessingJob.objects.filter(id=job_id, attempt=attempt, status__in=ACTIVE_STATUSES).update(
+        status=status, error=error, finished_at=timezone.now(), updated_at=timezone.now()
+    ))
+
+
+def cancel_job(job):
+    """Cancel a queued or running job and release the frame's run lock.
+
+    Chunks stop at their next cancel check; products already rendered keep
+    their outputs, and the job can be resumed later.
+    """
+    cache.set(cancel_key(job.id), 1, CANCEL_TIMEOUT)
+    return bool(ProcessingJob.objects.filter(id=job.id, status__in=ACTIVE_STATUSES).update(
+        status=CANCELLED, finished_at=timezone.now(), updated_at=timezone.now()
+    ))
+
+
+class CancelCheck:
+    """Callable reporting whether a chunk should stop, polling the shared
+    cache for a cancel at most once per JOB_CANCEL_CHECK_INTERVAL seconds.
+
+    With an attempt it also keeps the job's heartbeat alive every
+    JOB_HEARTBEAT_INTERVAL seconds, so a long chunk is not taken for a dead
+    one, and stops once the attempt is no longer the job's running one.
+    With a frame_id each poll also renews the frame's rendering lease.
+    """
+
+    def __init__(self, job_id, attempt=None, interval=None, frame_id=None):
+        self.job_id = job_id
+        self.attempt = attempt
+        self.frame_id = frame_id
+        self.interval = interval if interval is not None else settings.JOB_CANCEL_CHECK_INTERVAL
+        self.cancelled = False
+        self.last_check = 0.0
+        self.last_heartbeat = time.monotonic()
+
+    def __call__(self):
+        if self.job_id is None or self.cancelled:
+            return self.cancelled
+        now = time.monotonic()
+        if now - self.last_check >= self.interval:
+            self.last_check = now
+            if self.frame_id is not None:
+                mark_rendering(self.frame_id)
+            self.cancelled = cache.get(cancel_key(self.job_id)) is not None
+        if not self.cancelled and self.attempt is not None and now - self.last_heartbeat >= settings.JOB_HEARTBEAT_INTERVAL:
+            self.last_heartbeat = now
+            self.cancelled = not heartbeat(self.job_id, self.attempt)
+        return self.cancelled
+
+
+def mark_dispatched(job, chunk_count):
+    ProcessingJob.objects.filter(id=job.id, attempt=job.attempt).update(dispatched_chunks=chunk_count)
+
+
+def stale_jobs():
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_STALE_SECONDS)
+    candidates = ProcessingJob.objects.filter(status__in=ACTIVE_STATUSES, updated_at__lt=cutoff)
+    return [job for job in candidates if not waiting_for_worker(job)]
@@ -0,0 +1,102 @@
+import hashlib
+from datetime import datetime
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+
+def encode_cursor(output):
+    return f"{output.created_at.isoformat()}|{output.id}"
+
+
+def decode_cursor(cursor):
+    """(created_at, id) from a cursor, or None if it is malformed."""
+    try:
+        created_at, output_id = cursor.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(output_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def search_outputs(outputs, search_value):
+    """Filter outputs by product ID.
+
+    'prefix' matches the start of the ID and is served by the
+    (frame_id, product_id varchar_pattern_ops) index; 'contains' matches
+    anywhere and is served by the pg_trgm index on UPPER(product_id), the
+    expression Postgres compiles icontains to.
+    """
+    if not search_value:
+        return outputs
+    if settings.OUTPUT_SEARCH_MODE == 'prefix':
+        return outputs.filter(product_id__startswith=search_value)
+    return outputs.filter(product_id__icontains=search_value)
+
+
+def page_outputs(outputs, start, length, after=None):
+    """One page of outputs, newest first.
+
+    With a cursor from the previous page the page is read straight off the
+    (frame, -created_at, -id) index, so its cost does not depend on how deep
+    it is; without one it falls back to OFFSET. Returns the page and the
+    cursor of the next page.
+    """
+    outputs = outputs.order_by('-created_at', '-id')
+    position = decode_cursor(after) if after else None
+    if position is not None:
+        created_at, output_id = position
+        outputs = outputs.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=output_id)
+        )[:length]
+    else:
+        outputs = outputs[start:start + length]
+
+    page = list(outputs)
+    next_cursor = encode_cursor(page[-1]) if len(page) == length else None
+    return page, next_cursor
+
+
+def count_key(frame_id, search_value=''):
+    if not search_value:
+        return f"output_count_{frame_id}"
+    digest = hashlib.sha256(search_value.encode()).hexdigest()[:16]
+    return f"output_count_{frame_id}_{settings.OUTPUT_SEARCH_MODE}_{digest}"
+
+
+def output_count(frame_id, outputs, search_value=''):
+    """Cached number of outputs, for the DataTable totals.
+
+    Counts are kept for OUTPUT_COUNT_CACHE_SECONDS. Search counts stop at
+    OUTPUT_SEARCH_COUNT_LIMIT, which caps how many pages a broad search
+    offers rather than scanning every match on each keystroke.
+    """
+    key = count_key(frame_id, search_value)
+    total = cache.get(key)
+    if total is None:
+        if search_value:
+            total = outputs[:settings.OUTPUT_SEARCH_COUNT_LIMIT].count()
+        else:
+            total = outputs.count()
+        cache.set(key, total, settings.OUTPUT_COUNT_CACHE_SECONDS)
+    return total
+
+
+def rendered_count_key(frame_id):
+    return f"output_count_{frame_id}_rendered"
+
+
+def rendered_output_count(frame):
+    """Cached number of outputs that have an image, which sizes the ZIP
+    export parts; kept like output_count."""
+    key = rendered_count_key(frame.id)
+    total = cache.get(key)
+    if total is None:
+        total = frame.outputs.exclude(image='').count()
+        cache.set(key, total, settings.OUTPUT_COUNT_CACHE_SECONDS)
+    return total
+
+
+def invalidate_output_count(frame_id):
+    """Drop the cached totals after outputs were added or removed."""
+    cache.delete_many([count_key(frame_id), rendered_count_key(frame_id)])
+
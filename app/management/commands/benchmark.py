@@ -0,0 +1,153 @@
+import os, time, tempfile
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from app.benchmark import (
+    BenchmarkServer, IMAGE_FORMATS, PRODUCT_ID_FORMAT, image_pool, synthetic_frame, scratch_environment,
+    scratch_database, percentile, peak_rss_mb, ChildrenRSS, run_record, append_record,
+)
+from app.metrics import stage_summary
+from app.models import Frame
+from app.tasks import process_feed_entries
+
+
+def parse_size(value):
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise CommandError(f"Invalid image size {value!r}, expected WIDTHxHEIGHT")
+    return width, height
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the eager render task (process_feed_entries, with its chunks run inline) "
+        "against a synthetic feed served from a local HTTP server, and append the results to "
+        "a JSON Lines file. Each run uses a scratch frame in a throwaway test database, so "
+        "database writes and progress updates are measured without touching real data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--latency-ms', type=float, default=20.0, help="Delay per image/feed request")
+        parser.add_argument('--jitter-ms', type=float, default=10.0)
+        parser.add_argument('--sizes', default='400x400,1200x1200,3000x2000', help="Product image sizes")
+        parser.add_argument('--formats', default='jpeg,png,webp', help="Product image formats")
+        parser.add_argument('--output-format', default='png', choices=list(IMAGE_FORMATS))
+        parser.add_argument('--resample-mode', default='quality', choices=['quality', 'balanced', 'fast'])
+        parser.add_argument('--fetch-rate', type=float, default=0.0,
+                            help="Per-host request rate limit during the run (0 = unlimited)")
+        parser.add_argument('--repeat', type=int, default=1)
+        parser.add_argument('--label', default='', help="Free-form tag stored with the results")
+        parser.add_argument('--results', default=os.path.join(settings.BASE_DIR, 'benchmark_results.jsonl'))
+
+    def handle(self, *args, **options):
+        sizes = [parse_size(value) for value in options['sizes'].split(',')]
+        formats = options['formats'].split(',')
+        unknown = set(formats) - set(IMAGE_FORMATS)
+        if unknown:
+            raise CommandError(f"Unknown image formats: {', '.join(sorted(unknown))}")
+
+        params = {
+            # Earlier records rendered through RenderPipeline alone, without the task's DB work
+            'path': 'process_feed_entries',
+            'products': options['products'],
+            'latency_ms': options['latency_ms'],
+            'jitter_ms': options['jitter_ms'],
+            'sizes': options['sizes'],
+            'formats': options['formats'],
+            'output_format': options['output_format'],
+            'resample_mode': options['resample_mode'],
+            'fetch_rate': options['fetch_rate'],
+            'render_pool': settings.RENDER_POOL,
+            'render_workers': settings.RENDER_WORKERS or os.cpu_count(),
+            'chunk_size': settings.RENDER_CHUNK_SIZE,
+            'label': options['label'],
+        }
+
+        self.stdout.write(f"Generating {len(sizes) * len(formats)} synthetic product images...")
+        pool = image_pool(sizes, formats)
+
+        with BenchmarkServer(options['products'], pool, options['latency_ms'] / 1000, options['jitter_ms'] / 1000) as server:
+            for run in range(1, options['repeat'] + 1):
+                with ChildrenRSS() as children:
+                    results = self.run_once(server, options)
+                results['peak_rss_mb'] = peak_rss_mb()
+                # Summed RSS of the live render processes, sampled during the run
+                results['peak_rss_children_mb'] = children.peak_mb
+                record = run_record(params, results)
+                previous = append_record(options['results'], record)
+                self.report(run, results, previous)
+
+        self.stdout.write(f"Results appended to {options['results']}")
+
+    def run_once(self, server, options):
+        with tempfile.TemporaryDirectory(prefix='render-benchmark-') as tmp, \
+                scratch_environment(tmp, IMAGE_FETCH_RATE=options['fetch_rate']), scratch_database(tmp):
+            synthetic_frame(os.path.join(tmp, 'media', 'frames', 'benchmark.png'))
+            frame = Frame.objects.create(
+                name='Benchmark',
+                owner=User.objects.create(username='benchmark'),
+                xmlFeedPath=server.feed_url,
+                image='frames/benchmark.png',
+                coordinates={'x': 100, 'y': 100, 'width': 1000, 'height': 1000},
+                output_format=options['output_format'],
+                resample_mode=options['resample_mode'],
+            )
+
+            server.first_request.clear()
+            requests_before, bytes_before = server.requests, server.bytes_sent
+            # Called directly, the task runs its chunks inline: feed parsing, job
+            # bookkeeping, rendering, output rows and progress are all timed
+            begin = time.perf_counter()
+            summary = process_feed_entries(frame.id, incremental=False)
+            elapsed = time.perf_counter() - begin
+
+            job = frame.jobs.get()
+            if summary is None:
+                raise CommandError(f"Benchmark run failed: {job.error or 'see the log'}")
+            run_metrics = job.metrics
+            # Per-product latency: first request for its image until its row was written
+            finished = {
+                product_id: created_at.timestamp()
+                for product_id, created_at in frame.outputs.values_list('product_id', 'created_at')
+            }
+
+        started = {PRODUCT_ID_FORMAT.format(number): at for number, at in server.first_request.items()}
+        latencies = [
+            (finished[product_id] - started[product_id]) * 1000
+            for product_id in finished if product_id in started
+        ]
+        products = summary['total']
+        return {
+            'products': products,
+            'rendered': summary['processed'],
+            'failed': summary['failed'],
+            'seconds': round(elapsed, 3),
+            'products_per_sec': round(products / elapsed, 2) if elapsed else None,
+            'latency_ms_p50': round(percentile(latencies, 0.50) or 0, 1),
+            'latency_ms_p90': round(percentile(latencies, 0.90) or 0, 1),
+            'latency_ms_p99': round(percentile(latencies, 0.99) or 0, 1),
+            'latency_ms_max': round(max(latencies, default=0), 1),
+            'http_requests': server.requests - requests_before,
+            'http_mb': round((server.bytes_sent - bytes_before) / (1024 * 1024), 1),
+            'stage_seconds': {stage: seconds for stage, seconds, _ in stage_summary(run_metrics)},
+            'failures': run_metrics.get('failures', {}),
+        }
+
+    def report(self, run, results, previous):
+        self.stdout.write(
+            f"Run {run}: {results['products']} products in {results['seconds']}s "
+            f"({results['products_per_sec']}/s, {results['failed']} failed), latency p50/p90/p99 "
+            f"{results['latency_ms_p50']}/{results['latency_ms_p90']}/{results['latency_ms_p99']} ms, "
+            f"peak RSS {results['peak_rss_mb']} MB (+{results['peak_rss_children_mb']} MB in children)"
+        )
+        if results['stage_seconds']:
+            stages = ", ".join(f"{stage} {seconds}s" for stage, seconds in results['stage_seconds'].items())
+            self.stdout.write(f"  busy time by stage: {stages}")
+        if previous and previous['results'].get('products_per_sec') and results['products_per_sec']:
+            change = results['products_per_sec'] / previous['results']['products_per_sec'] - 1
+            self.stdout.write(
+                f"  vs {previous['timestamp']} ({previous.get('git_commit') or 'unknown commit'}): "
+                f"{change:+.1%} products/sec"
+            )
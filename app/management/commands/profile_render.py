@@ -0,0 +1,239 @@
+import os, copy, time, shutil, tempfile
+from contextlib import ExitStack
+from itertools import islice
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from app.benchmark import (
+    scratch_environment, scratch_database, synthetic_frame, DiscardOutputs, peak_rss_mb, git_commit,
+)
+from app.fetching import timed_fetch
+from app.metrics import RenderMetrics, stage_summary
+from app.models import Frame, LOCAL_FEED_PREFIX
+from app.pipeline import RenderPipeline, render_pool, render_spec, render_to_bytes, RENDERED, SKIPPED, FAILED
+from app.profiling import ThreadProfiler, AllocationTracker, format_stats, format_allocations
+from app.rendering import render_fingerprint
+from app.tasks import process_feed_entries
+from app.utils import iter_source_entries
+
+
+def parse_coordinates(value):
+    try:
+        x, y, width, height = (int(part) for part in value.split(','))
+    except ValueError:
+        raise CommandError(f"Invalid coordinates {value!r}, expected X,Y,WIDTH,HEIGHT")
+    return {'x': x, 'y': y, 'width': width, 'height': height}
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the render pipeline for a frame or a local feed file outside Celery, optionally under "
+        "cProfile and tracemalloc, and write the hot spots to a report file. Runs use an unsaved "
+        "scratch copy of the frame and throwaway media; output rows are counted, not written, so "
+        "neither real outputs nor the database are touched. With --task the Celery task itself "
+        "(process_feed_entries, chunks run inline) is profiled on a copy of the frame in a "
+        "throwaway database, DB writes and progress updates included."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frame', type=int, help="Frame to copy the feed, image and settings from")
+        parser.add_argument('--feed', help="Local feed file to render instead of the frame's feed URL")
+        parser.add_argument('--frame-image', help="Frame image when no --frame is given (default: synthetic)")
+        parser.add_argument('--coordinates', default='100,100,1000,1000',
+                            help="X,Y,WIDTH,HEIGHT when no --frame is given")
+        parser.add_argument('--output-format', choices=['png', 'webp', 'jpeg'])
+        parser.add_argument('--resample-mode', choices=['quality', 'balanced', 'fast'])
+        parser.add_argument('--limit', type=int, help="Only render the first N feed products")
+        parser.add_argument('--product', help="Profile fetching and rendering this one product instead of a full run")
+        parser.add_argument('--task', action='store_true',
+                            help="Profile process_feed_entries on a scratch database instead of the bare pipeline")
+        parser.add_argument('--repeat', type=int, default=1, help="Renders of --product")
+        parser.add_argument('--cprofile', action='store_true', help="Profile every render thread with cProfile")
+        parser.add_argument('--tracemalloc', action='store_true', help="Track Python allocations with tracemalloc")
+        parser.add_argument('--snapshot-interval', type=float, default=1.0,
+                            help="Seconds between tracemalloc peak samples")
+        parser.add_argument('--sort', default='cumulative', choices=['cumulative', 'tottime', 'calls'])
+        parser.add_argument('--top', type=int, default=30, help="Functions and allocation sites per listing")
+        parser.add_argument('--pstats', help="Also dump the merged cProfile stats here (for snakeviz etc.)")
+        parser.add_argument('--report', help="Report file (default: profile_render_<timestamp>.txt)")
+
+    def handle(self, *args, **options):
+        if options['frame'] is None and not options['feed']:
+            raise CommandError("Give --frame, --feed or both")
+        if options['feed'] and not os.path.isfile(options['feed']):
+            raise CommandError(f"Feed file {options['feed']} does not exist")
+        if options['pstats'] and not options['cprofile']:
+            raise CommandError("--pstats needs --cprofile")
+        if options['task'] and (options['frame'] is None or options['feed'] or options['product'] or options['limit']):
+            raise CommandError("--task renders a --frame's own feed; it takes no --feed, --product or --limit")
+
+        source = None
+        if options['frame'] is not None:
+            source = Frame.objects.filter(id=options['frame']).first()
+            if source is None:
+                raise CommandError(f"Frame {options['frame']} does not exist")
+            if not source.coordinates:
+                raise CommandError(f"Frame {source.id} has no coordinates set")
+            # Resolved against the real MEDIA_ROOT, before the scratch one replaces it
+            frame_image = source.image.path
+        else:
+            frame_image = options['frame_image']
+
+        feed = options['feed'] or source.xmlFeedPath
+        if feed.startswith(LOCAL_FEED_PREFIX):
+            if options['task']:
+                raise CommandError(f"Frame {source.id} has a local feed, which the task cannot render")
+            feed = feed[len(LOCAL_FEED_PREFIX):]
+
+        report_path = options['report'] or f"profile_render_{time.strftime('%Y%m%d-%H%M%S')}.txt"
+        with ExitStack() as stack:
+            tmp = stack.enter_context(tempfile.TemporaryDirectory(prefix='render-profile-'))
+            # The task uses the process-wide render pool: threads, so the profilers see it
+            overrides = {'RENDER_POOL': 'thread'} if options['task'] else {}
+            image_cache = stack.enter_context(scratch_environment(tmp, **overrides))
+            if options['task']:
+                stack.enter_context(scratch_database(tmp))
+            frame = self.scratch_frame(tmp, source, frame_image, options)
+            sections = self.profile(frame, feed, image_cache, options)
+
+        report = '\n\n'.join(self.header(source, feed, options) + sections) + '\n'
+        with open(report_path, 'w') as f:
+            f.write(report)
+        self.stdout.write(sections[0])
+        self.stdout.write(f"Report written to {report_path}")
+
+    def scratch_frame(self, tmp, source, frame_image, options):
+        """Copy of the source frame (or a new one). It is only saved, to the
+        scratch database, with --task; otherwise its id only names the
+        scratch outputs directory."""
+        image_name = 'frames/profile.png'
+        image_path = os.path.join(tmp, 'media', image_name)
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+
+        if frame_image:
+            shutil.copyfile(frame_image, image_path)
+        else:
+            synthetic_frame(image_path)
+
+        if source is not None:
+            # source was loaded before any scratch database was switched in
+            frame = copy.deepcopy(source)
+            frame.name = f"Profile of {source.name}"[:100]
+        else:
+            frame = Frame(name='Profile', coordinates=parse_coordinates(options['coordinates']))
+
+        frame.pk = 0
+        frame.image = image_name
+        if options['output_format']:
+            frame.output_format = options['output_format']
+        if options['resample_mode']:
+            frame.resample_mode = options['resample_mode']
+        if options['task']:
+            frame.pk = None
+            frame.owner = User.objects.create(username='profile')
+            frame.save(force_insert=True)
+        return frame
+
+    def profile(self, frame, feed, image_cache, options):
+        with ExitStack() as stack:
+            # tracemalloc first, so its sampler thread is not profiled
+            tracker = stack.enter_context(AllocationTracker(options['snapshot_interval'])) if options['tracemalloc'] else None
+            profiler = stack.enter_context(ThreadProfiler()) if options['cprofile'] else None
+            begin = time.perf_counter()
+            summary, metrics = self.run(frame, feed, image_cache, options)
+            elapsed = time.perf_counter() - begin
+
+        run_metrics = metrics.as_dict()
+        stages = ", ".join(f"{stage} {seconds}s ({share}%)" for stage, seconds, share in stage_summary(run_metrics))
+        lines = [f"Elapsed: {elapsed:.2f}s, peak RSS {peak_rss_mb()} MB", f"Result: {summary}"]
+        if stages:
+            lines.append(f"Busy time by stage: {stages}")
+        if run_metrics['failures']:
+            lines.append(f"Failures by reason: {run_metrics['failures']}")
+        sections = ['\n'.join(lines)]
+
+        if profiler is not None:
+            sections.append(f"== cProfile: top {options['top']} by {options['sort']} ==\n"
+                            + format_stats(profiler, options['sort'], options['top']))
+            if options['sort'] != 'tottime':
+                sections.append(f"== cProfile: top {options['top']} by tottime (own time) ==\n"
+                                + format_stats(profiler, 'tottime', options['top']))
+            if options['pstats']:
+                profiler.stats().dump_stats(options['pstats'])
+        if tracker is not None:
+            sections.append("== tracemalloc ==\n" + format_allocations(tracker, options['top']))
+        return sections
+
+    def run(self, frame, feed, image_cache, options):
+        metrics = RenderMetrics()
+        if options['product']:
+            return self.run_product(frame, feed, image_cache, metrics, options), metrics
+        if options['task']:
+            return self.run_task(frame)
+
+        entries = iter_source_entries(feed)
+        if options['limit']:
+            entries = islice(entries, options['limit'])
+        with metrics.timer('feed'):
+            entries = list(entries)
+
+        counts = {RENDERED: 0, SKIPPED: 0, FAILED: 0}
+
+        def product_done(product_id, status):
+            counts[status] += 1
+
+        # Threads only, created here so they start under the profiler:
+        # cProfile and tracemalloc cannot see into render processes
+        executor = render_pool('thread', settings.RENDER_WORKERS or os.cpu_count())
+        try:
+            pipeline = RenderPipeline(
+                frame, render_fingerprint(frame), DiscardOutputs(), product_done,
+                metrics=metrics, executor=executor, image_cache=image_cache,
+            )
+            pipeline.run(entries)
+        finally:
+            executor.shutdown()
+        summary = {
+            'processed': counts[RENDERED] + counts[SKIPPED],
+            'failed': counts[FAILED],
+            'total': sum(counts.values()),
+        }
+        return summary, metrics
+
+    def run_task(self, frame):
+        """Run process_feed_entries directly, so its chunks render inline in
+        this process; stage times come from the job's run summary."""
+        summary = process_feed_entries(frame.id, incremental=False)
+        job = frame.jobs.get()
+        if summary is None:
+            raise CommandError(f"Render task failed: {job.error or 'see the log'}")
+        return summary, RenderMetrics(job.metrics)
+
+    def run_product(self, frame, feed, image_cache, metrics, options):
+        """Fetch one product once and render it repeat times."""
+        image_link = next(
+            (image_link for product_id, image_link in iter_source_entries(feed) if product_id == options['product']),
+            None,
+        )
+        if not image_link:
+            raise CommandError(f"Product {options['product']} is not in the feed")
+        content = timed_fetch(metrics, image_link, cache=image_cache).content
+        spec = render_spec(frame)
+        for _ in range(options['repeat']):
+            metrics.add_timings(render_to_bytes(spec, content)[2])
+        return {'product': options['product'], 'image_link': image_link, 'renders': options['repeat']}
+
+    def header(self, source, feed, options):
+        target = f"frame {source.id} ({source.name})" if source is not None else "scratch frame"
+        if options['product']:
+            mode = f"product {options['product']} x{options['repeat']}"
+        else:
+            mode = "task (process_feed_entries)" if options['task'] else "full run"
+        return [
+            f"Render profile {time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())} "
+            f"(commit {git_commit() or 'unknown'})\n"
+            f"Target: {target}, feed: {feed}\n"
+            f"Mode: {mode}{', limit ' + str(options['limit']) if options['limit'] else ''}, "
+            f"cProfile: {'on' if options['cprofile'] else 'off'}, "
+            f"tracemalloc: {'on' if options['tracemalloc'] else 'off'}"
+        ]
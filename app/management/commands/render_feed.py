@@ -0,0 +1,224 @@
+import os, json, time
+from itertools import islice
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from app.jobs import (
+    RUNNING, COMPLETED, CANCELLED, FAILED as FAILED_JOB, start_job, heartbeat, finish_job, mark_rendering,
+)
+from app.listing import invalidate_output_count
+from app.metrics import RenderMetrics, stage_summary
+from app.models import Frame, ProcessingJob, LOCAL_FEED_PREFIX
+from app.pipeline import RenderPipeline, render_pool, unchanged_outputs, RENDERED, SKIPPED, FAILED
+from app.rendering import render_fingerprint
+from app.tasks import OutputBuffer
+from app.utils import iter_source_entries
+
+# Seconds between job heartbeats / cancel checks
+WATCH_INTERVAL = 5.0
+
+
+def feed_entries(feed):
+    """Stream complete (product_id, image_link) pairs from a feed URL or local file."""
+    if feed.startswith(LOCAL_FEED_PREFIX):
+        # A frame created from a local feed file
+        feed = feed[len(LOCAL_FEED_PREFIX):]
+        if not os.path.isfile(feed):
+            raise CommandError(f"Local feed file {feed} no longer exists, pass --feed")
+    return iter_source_entries(feed)
+
+
+def parse_coordinates(value):
+    try:
+        coordinates = json.loads(value)
+        return {key: int(coordinates[key]) for key in ('x', 'y', 'width', 'height')}
+    except (ValueError, TypeError, KeyError):
+        raise CommandError(f"Invalid coordinates {value!r}, expected JSON with x, y, width and height")
+
+
+class JobWatch:
+    """should_stop for the pipeline: keeps the job's heartbeat and the
+    frame's rendering lease alive and notices a Cancel from the web UI,
+    checking the database (not the cache) every WATCH_INTERVAL seconds."""
+
+    def __init__(self, job):
+        self.job = job
+        self.cancelled = False
+        self.last_check = time.monotonic()
+        self.renew_lease()
+
+    def renew_lease(self):
+        try:
+            mark_rendering(self.job.frame_id)
+        except Exception:
+            # No shared cache here; deleting the frame then only waits for the job
+            pass
+
+    def __call__(self):
+        if not self.cancelled and time.monotonic() - self.last_check >= WATCH_INTERVAL:
+            self.last_check = time.monotonic()
+            heartbeat(self.job.id, self.job.attempt)
+            self.renew_lease()
+            self.cancelled = ProcessingJob.objects.filter(id=self.job.id, status=CANCELLED).exists()
+        return self.cancelled
+
+
+class Command(BaseCommand):
+    help = (
+        "Render a whole feed for a frame on this machine with a local process pool, without "
+        "Celery, the broker or progress messages. Outputs go to the usual outputs/<frame_id>/ "
+        "layout and OutputImage rows are bulk-inserted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frame', type=int, help="Frame to render")
+        parser.add_argument('--feed', help="Feed URL or local feed file (default: the frame's feed)")
+        parser.add_argument('--frame-image', help="Create a new frame from this image (instead of --frame)")
+        parser.add_argument('--coordinates', help='Product placement for --frame-image, e.g. \'{"x": 100, "y": 100, "width": 800, "height": 800}\'')
+        parser.add_argument('--owner', help="Username owning the new frame")
+        parser.add_argument('--name', help="Name of the new frame (default: the image file name)")
+        parser.add_argument('--workers', type=int, default=settings.RENDER_WORKERS or os.cpu_count(),
+                            help="Render processes (default: RENDER_WORKERS or all cores)")
+        parser.add_argument('--pool', default='process', choices=['process', 'thread'])
+        parser.add_argument('--full', action='store_true', help="Re-render products whose inputs are unchanged")
+        parser.add_argument('--limit', type=int, help="Only render the first N feed products")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Products per unchanged-output lookup")
+        parser.add_argument('--batch-size', type=int, default=max(1000, settings.OUTPUT_WRITE_BATCH_SIZE),
+                            help="OutputImage rows per bulk insert")
+        parser.add_argument('--report-every', type=float, default=5.0, help="Seconds between throughput lines")
+
+    def handle(self, *args, **options):
+        if (options['frame'] is None) == (options['frame_image'] is None):
+            raise CommandError("Give either --frame or --frame-image")
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+
+        frame = self.get_frame(options) if options['frame'] is not None else self.create_frame(options)
+        if not frame.coordinates:
+            raise CommandError(f"Frame {frame.id} has no coordinates set")
+        feed = options['feed'] or frame.xmlFeedPath
+
+        job, created = start_job(frame, incremental=not options['full'])
+        if not created:
+            raise CommandError(f"Frame {frame.id} already has an active job ({job.id})")
+        render_hash = render_fingerprint(frame)
+        job.status = RUNNING
+        job.attempt += 1
+        job.render_hash = render_hash
+        job.save()
+
+        self.stdout.write(
+            f"Rendering {feed} for frame {frame.id} with {options['workers']} {options['pool']} workers (job {job.id})"
+        )
+        executor = render_pool(options['pool'], options['workers'])
+
+        self.counts = {RENDERED: 0, SKIPPED: 0, FAILED: 0}
+        self.started = self.last_report = time.monotonic()
+        self.reported = 0
+        self.report_every = options['report_every']
+        metrics = RenderMetrics()
+        watch = JobWatch(job)
+        status, error = COMPLETED, ''
+        try:
+            self.render(frame, feed, render_hash, executor, metrics, watch, options)
+            if watch.cancelled:
+                status = CANCELLED
+        except KeyboardInterrupt:
+            status = CANCELLED
+            self.stderr.write("Interrupted, outputs rendered so far are kept")
+        except Exception as e:
+            status, error = FAILED_JOB, str(e)
+            raise
+        finally:
+            executor.shutdown(cancel_futures=True)
+            self.finish(job, status, error, metrics)
+
+    def get_frame(self, options):
+        frame = Frame.objects.filter(id=options['frame']).first()
+        if frame is None:
+            raise CommandError(f"Frame {options['frame']} does not exist")
+        return frame
+
+    def create_frame(self, options):
+        for option in ('coordinates', 'owner', 'feed'):
+            if not options[option]:
+                raise CommandError(f"--frame-image needs --{option}")
+        if not os.path.isfile(options['frame_image']):
+            raise CommandError(f"Frame image {options['frame_image']} does not exist")
+        owner = User.objects.filter(username=options['owner']).first()
+        if owner is None:
+            raise CommandError(f"User {options['owner']} does not exist")
+
+        feed = options['feed']
+        frame = Frame(
+            name=(options['name'] or os.path.basename(options['frame_image']))[:100],
+            owner=owner,
+            coordinates=parse_coordinates(options['coordinates']),
+            # A local feed can only be rendered from here (see Frame.has_local_feed)
+            xmlFeedPath=(f"{LOCAL_FEED_PREFIX}{os.path.abspath(feed)}" if os.path.isfile(feed) else feed)[:200],
+        )
+        with open(options['frame_image'], 'rb') as f:
+            frame.image.save(os.path.basename(options['frame_image']), File(f), save=False)
+        frame.save()
+        self.stdout.write(f"Created frame {frame.id} ({frame.name})")
+        return frame
+
+    def render(self, frame, feed, render_hash, executor, metrics, watch, options):
+        entries = feed_entries(feed)
+        if options['limit']:
+            entries = islice(entries, options['limit'])
+        outputs = OutputBuffer(batch_size=options['batch_size'], metrics=metrics)
+        # Enough renders in flight to keep every worker busy
+        queue_size = max(settings.RENDER_QUEUE_SIZE, 2 * options['workers'])
+
+        while not watch.cancelled:
+            chunk = list(islice(entries, options['chunk_size']))
+            if not chunk:
+                break
+            unchanged = {} if options['full'] else unchanged_outputs(frame, chunk, render_hash)
+            pipeline = RenderPipeline(
+                frame, render_hash, outputs, self.product_done,
+                queue_size=queue_size, metrics=metrics, executor=executor,
+            )
+            pipeline.run(chunk, unchanged, watch)
+
+    def product_done(self, product_id, status):
+        # Called from the pipeline's writer thread
+        self.counts[status] += 1
+        now = time.monotonic()
+        if now - self.last_report >= self.report_every:
+            done = sum(self.counts.values())
+            self.stdout.write(
+                f"{done} products, {done / (now - self.started):.1f}/s "
+                f"(last {now - self.last_report:.0f}s: {(done - self.reported) / (now - self.last_report):.1f}/s), "
+                f"{self.counts[FAILED]} failed"
+            )
+            self.last_report, self.reported = now, done
+
+    def finish(self, job, status, error, metrics):
+        elapsed = time.monotonic() - self.started
+        done = sum(self.counts.values())
+        ProcessingJob.objects.filter(id=job.id).update(
+            total=done,
+            checkpoint=done,
+            processed=self.counts[RENDERED] + self.counts[SKIPPED],
+            skipped=self.counts[SKIPPED],
+            failed=self.counts[FAILED],
+            metrics=metrics.as_dict(),
+        )
+        finish_job(job.id, job.attempt, status, error)
+        try:
+            invalidate_output_count(job.frame_id)
+        except Exception as e:
+            # No shared cache here; cached counts expire on their own
+            self.stderr.write(f"Could not reset the cached output count: {e}")
+
+        self.stdout.write(
+            f"{status.capitalize()}: {done} products in {elapsed:.1f}s "
+            f"({done / elapsed if elapsed else 0:.1f}/s), {self.counts[RENDERED]} rendered, "
+            f"{self.counts[SKIPPED]} unchanged, {self.counts[FAILED]} failed"
+        )
+        stages = ", ".join(f"{stage} {seconds}s" for stage, seconds, _ in stage_summary(metrics.as_dict()))
+        if stages:
+            self.stdout.write(f"Busy time by stage: {stages}")
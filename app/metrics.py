@@ -0,0 +1,202 @@
+import os, time, socket, threading, logging
+from contextlib import contextmanager
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Render stages in pipeline order
+STAGES = ('feed', 'fetch', 'decode', 'resize', 'composite', 'encode', 'thumbnail', 'write', 'db')
+
+# Cache slots holding one worker's totals each; the metrics endpoint reads them all
+WORKER_SLOTS = 256
+
+
+@contextmanager
+def timed(timings, stage):
+    """Add the block's duration to timings[stage]; a no-op when timings is None.
+
+    Plain dicts keep this usable inside render pool processes, whose
+    timings travel back with the result.
+    """
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def failure_reason(error):
+    response = getattr(error, 'response', None)
+    if isinstance(error, requests.HTTPError) and response is not None:
+        return f"http_{response.status_code}"
+    return type(error).__name__
+
+
+class RenderMetrics:
+    """Thread-safe accumulator of stage timings, counters, failures by
+    reason and queue depth samples.
+
+    as_dict() output is JSON-serialisable and can be merged into another
+    instance, which is how chunk metrics add up to a per-run summary and to
+    the totals of a worker process.
+    """
+
+    def __init__(self, data=None):
+        self.stages = {}
+        self.counters = {}
+        self.failures = {}
+        self.queues = {}
+        self._lock = threading.Lock()
+        if data:
+            self.merge(data)
+
+    def add_time(self, stage, seconds, count=1):
+        with self._lock:
+            self._observe(self.stages, stage, seconds, count, seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_timings(self, timings):
+        for stage, seconds in timings.items():
+            self.add_time(stage, seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def failure(self, reason):
+        with self._lock:
+            self.failures[reason] = self.failures.get(reason, 0) + 1
+
+    def sample_queue(self, name, depth):
+        with self._lock:
+            self._observe(self.queues, name, depth, 1, depth)
+
+    @staticmethod
+    def _observe(table, name, total, count, peak):
+        entry = table.setdefault(name, {'count': 0, 'total': 0, 'max': 0})
+        entry['count'] += count
+        entry['total'] += total
+        entry['max'] = max(entry['max'], peak)
+
+    def merge(self, data):
+        with self._lock:
+            for table, values in ((self.stages, data.get('stages', {})), (self.queues, data.get('queues', {}))):
+                for name, entry in values.items():
+                    self._observe(table, name, entry['total'], entry['count'], entry['max'])
+            for table, values in ((self.counters, data.get('counters', {})), (self.failures, data.get('failures', {}))):
+                for name, value in values.items():
+                    table[name] = table.get(name, 0) + value
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'stages': {name: dict(entry) for name, entry in self.stages.items()},
+                'counters': dict(self.counters),
+                'failures': dict(self.failures),
+                'queues': {name: dict(entry) for name, entry in self.queues.items()},
+            }
+
+
+def stage_summary(data):
+    """[(stage, seconds, percent of busy time)] in pipeline order, for display.
+
+    Stages overlap across threads and processes, so the seconds add up to
+    busy time rather than wall time.
+    """
+    stages = (data or {}).get('stages', {})
+    busy = sum(entry['total'] for entry in stages.values()) or 1
+    ordered = [stage for stage in STAGES if stage in stages] + sorted(set(stages) - set(STAGES))
+    return [(stage, round(stages[stage]['total'], 2), round(100 * stages[stage]['total'] / busy)) for stage in ordered]
+
+
+_worker_metrics = RenderMetrics()
+_slot = None
+_slot_lock = threading.Lock()
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def slot_key(slot):
+    return f"render_metrics_slot_{slot}"
+
+
+def claim_slot(snapshot, timeout):
+    """Store snapshot in a free slot and return its number (None if all are
+    taken). cache.add only succeeds on a free slot, so no two workers share
+    one; slots of workers that stopped publishing expire and are reused."""
+    start = os.getpid() % WORKER_SLOTS
+    for offset in range(WORKER_SLOTS):
+        slot = (start + offset) % WORKER_SLOTS
+        if cache.add(slot_key(slot), snapshot, timeout):
+            return slot
+    logger.warning(f"All {WORKER_SLOTS} render metrics slots are taken")
+    return None
+
+
+def publish_worker_metrics(metrics):
+    """Fold metrics into this process's totals and share them through the
+    cache, where the metrics endpoint collects every worker's totals."""
+    global _slot
+    _worker_metrics.merge(metrics.as_dict())
+    worker = worker_id()
+    snapshot = {'worker': worker, 'updated_at': time.time(), 'metrics': _worker_metrics.as_dict()}
+    timeout = settings.METRICS_RETENTION_SECONDS
+    try:
+        with _slot_lock:
+            # The slot may have expired and been claimed by another worker
+            owned = _slot is not None and (cache.get(slot_key(_slot)) or {}).get('worker') == worker
+            if owned:
+                cache.set(slot_key(_slot), snapshot, timeout)
+            else:
+                _slot = claim_slot(snapshot, timeout)
+    except Exception as e:
+        # Metrics must never fail a render
+        logger.warning(f"Could not publish render metrics: {e}")
+
+
+def collect_worker_metrics():
+    """{worker: metrics dict} for every worker that published recently."""
+    snapshots = cache.get_many([slot_key(slot) for slot in range(WORKER_SLOTS)])
+    return {snapshot['worker']: snapshot['metrics'] for snapshot in snapshots.values()}
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus_text(snapshots):
+    """Render worker metrics in the Prometheus text exposition format."""
+    families = [
+        ('render_stage_seconds_total', 'counter', 'Time spent per render stage', 'stages', 'stage', 'total'),
+        ('render_stage_calls_total', 'counter', 'Timed calls per render stage', 'stages', 'stage', 'count'),
+        ('render_stage_seconds_max', 'gauge', 'Slowest single call per render stage', 'stages', 'stage', 'max'),
+        ('render_events_total', 'counter', 'Render counters (products, bytes, cache hits, rows)', 'counters', 'name', None),
+        ('render_failures_total', 'counter', 'Failed products by reason', 'failures', 'reason', None),
+        ('render_queue_depth_max', 'gauge', 'Deepest observed pipeline queue', 'queues', 'queue', 'max'),
+        ('render_queue_depth_samples_total', 'counter', 'Pipeline queue depth samples', 'queues', 'queue', 'count'),
+        ('render_queue_depth_sum', 'counter', 'Sum of sampled pipeline queue depths', 'queues', 'queue', 'total'),
+    ]
+    lines = []
+    for name, kind, help_text, table, label, field in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for worker, metrics in sorted(snapshots.items()):
+            for key, value in sorted(metrics.get(table, {}).items()):
+                if field is not None:
+                    value = value[field]
+                lines.append(f'{name}{{worker="{escape_label(worker)}",{label}="{escape_label(key)}"}} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:41
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0002_output_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='frame',
+            name='output_format',
+            field=models.CharField(choices=[('png', 'PNG'), ('webp', 'WebP'), ('jpeg', 'Progressive JPEG')], default='png', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='frame',
+            name='output_quality',
+            field=models.PositiveSmallIntegerField(default=85, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(100)]),
+        ),
+        migrations.AddField(
+            model_name='frame',
+            name='png_compress_level',
+            field=models.PositiveSmallIntegerField(default=6, validators=[django.core.validators.MaxValueValidator(9)]),
+        ),
+        migrations.AddField(
+            model_name='frame',
+            name='png_optimize',
+            field=models.BooleanField(default=False),
+        ),
+    ]
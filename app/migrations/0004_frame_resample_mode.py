@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_frame_output_settings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='frame',
+            name='resample_mode',
+            field=models.CharField(choices=[('quality', 'Best quality (Lanczos)'), ('balanced', 'Balanced (Bicubic)'), ('fast', 'Fastest (Bilinear)')], default='quality', max_length=10),
+        ),
+    ]
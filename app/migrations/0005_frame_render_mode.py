@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_frame_resample_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='frame',
+            name='render_mode',
+            field=models.CharField(choices=[('eager', 'Pre-render all outputs'), ('lazy', 'Render each output on first request')], default='eager', max_length=10),
+        ),
+    ]
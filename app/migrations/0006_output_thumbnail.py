@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_frame_render_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outputimage',
+            name='thumbnail',
+            field=models.ImageField(blank=True, upload_to='output_images/'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_output_thumbnail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='frame',
+            name='deleting',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:51
+
+from django.db import migrations, models
+
+
+# Product ID search indexes, Postgres only: a trigram index for 'contains'
+# search and a pattern_ops index for 'prefix' search
+SEARCH_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS app_outputimage_product_id_trgm "
+    "ON app_outputimage USING gin (product_id gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS app_outputimage_product_id_prefix "
+    "ON app_outputimage (frame_id, product_id varchar_pattern_ops)",
+]
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for sql in SEARCH_INDEXES:
+        schema_editor.execute(sql)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS app_outputimage_product_id_trgm")
+    schema_editor.execute("DROP INDEX IF EXISTS app_outputimage_product_id_prefix")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_frame_deleting'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='outputimage',
+            name='app_outputi_frame_i_eafc8d_idx',
+        ),
+        migrations.AddIndex(
+            model_name='outputimage',
+            index=models.Index(fields=['frame', '-created_at', '-id'], name='app_outputi_frame_i_00d827_idx'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_processing_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='metrics',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-18 03:10
+
+from django.db import migrations
+
+
+# 'contains' search (product_id__icontains) compiles to
+# UPPER("product_id"::text) LIKE UPPER(%s) on Postgres, which a trigram index
+# on the bare column cannot serve; index that expression instead
+UPPER_TRGM_INDEX = (
+    "CREATE INDEX IF NOT EXISTS app_outputimage_product_id_upper_trgm "
+    "ON app_outputimage USING gin ((UPPER(product_id::text)) gin_trgm_ops)"
+)
+BARE_TRGM_INDEX = (
+    "CREATE INDEX IF NOT EXISTS app_outputimage_product_id_trgm "
+    "ON app_outputimage USING gin (product_id gin_trgm_ops)"
+)
+
+
+def create_upper_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(UPPER_TRGM_INDEX)
+    schema_editor.execute("DROP INDEX IF EXISTS app_outputimage_product_id_trgm")
+
+
+def restore_bare_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(BARE_TRGM_INDEX)
+    schema_editor.execute("DROP INDEX IF EXISTS app_outputimage_product_id_upper_trgm")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_processingjob_metrics'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_upper_index, restore_bare_index),
+    ]
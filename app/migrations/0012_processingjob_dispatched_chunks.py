@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_output_search_upper_trgm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='processingjob',
+            name='dispatched_chunks',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
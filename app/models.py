@@ -1,6 +1,36 @@
 from django.contrib.auth.models import User
+from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
 
+OUTPUT_FORMAT_CHOICES = [
+    ('png', 'PNG'),
+    ('webp', 'WebP'),
+    ('jpeg', 'Progressive JPEG'),
+]
+
+RESAMPLE_MODE_CHOICES = [
+    ('quality', 'Best quality (Lanczos)'),
+    ('balanced', 'Balanced (Bicubic)'),
+    ('fast', 'Fastest (Bilinear)'),
+]
+
+RENDER_MODE_CHOICES = [
+    ('eager', 'Pre-render all outputs'),
+    ('lazy', 'Render each output on first request'),
+]
+
+# xmlFeedPath prefix of frames rendered from a local feed file by the
+# render_feed command; the web app cannot fetch these feeds
+LOCAL_FEED_PREFIX = 'file://'
+
+JOB_STATUS_CHOICES = [
+    ('queued', 'Queued'),
+    ('running', 'Running'),
+    ('completed', 'Completed'),
+    ('failed', 'Failed'),
+    ('cancelled', 'Cancelled'),
+]
+
 class Frame(models.Model):
     name = models.CharField(max_length=100)
     xmlFeedPath = models.CharField(max_length=200)
@@ -8,6 +38,19 @@ class Frame(models.Model):
     image = models.ImageField(upload_to='frames/')
     coordinates = models.JSONField(default=dict)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Output encoding settings
+    output_format = models.CharField(max_length=10, choices=OUTPUT_FORMAT_CHOICES, default='png')
+    output_quality = models.PositiveSmallIntegerField(
+        default=85, validators=[MinValueValidator(1), MaxValueValidator(100)]
+    )
+    png_compress_level = models.PositiveSmallIntegerField(
+        default=6, validators=[MaxValueValidator(9)]
+    )
+    png_optimize = models.BooleanField(default=False)
+    resample_mode = models.CharField(max_length=10, choices=RESAMPLE_MODE_CHOICES, default='quality')
+    render_mode = models.CharField(max_length=10, choices=RENDER_MODE_CHOICES, default='eager')
+    # Set while a background task deletes the frame and its outputs
+    deleting = models.BooleanField(default=False)
     
     class Meta:
         ordering = ['-created_at']
@@ -17,13 +60,23 @@ class Frame(models.Model):
     
     def __str__(self):
         return self.name
+
+    @property
+    def has_local_feed(self):
+        return self.xmlFeedPath.startswith(LOCAL_FEED_PREFIX)
     
 class OutputImage(models.Model):
     product_id = models.CharField(max_length=100)
     product_image_url = models.URLField()
     frame = models.ForeignKey(Frame, on_delete=models.CASCADE, related_name='outputs')
     image = models.ImageField(upload_to='output_images/')
+    thumbnail = models.ImageField(upload_to='output_images/', blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Fingerprint of the inputs used for incremental re-renders
+    source_etag = models.CharField(max_length=255, blank=True, default='')
+    source_last_modified = models.CharField(max_length=64, blank=True, default='')
+    source_hash = models.CharField(max_length=64, blank=True, default='')
+    render_hash = models.CharField(max_length=64, blank=True, default='')
     
     class Meta:
         # Ensure unique product_id per frame to prevent duplicates
@@ -31,8 +84,51 @@ class OutputImage(models.Model):
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['frame', 'product_id']),
-            models.Index(fields=['frame', '-created_at']),
+            # Keyset pagination of the outputs table (see listing.page_outputs)
+            models.Index(fields=['frame', '-created_at', '-id']),
+        ]
+    
+    def __str__(self):
+        return f"OutputImage for {self.frame.name} - {self.product_id} at {self.created_at}"
+
+class ProcessingJob(models.Model):
+    """One render run of a frame's feed, with the checkpoint it can resume from."""
+    frame = models.ForeignKey(Frame, on_delete=models.CASCADE, related_name='jobs')
+    status = models.CharField(max_length=10, choices=JOB_STATUS_CHOICES, default='queued')
+    incremental = models.BooleanField(default=True)
+    # Bumped on every (re)dispatch; chunks of an older attempt are ignored
+    attempt = models.PositiveIntegerField(default=0)
+    # Feed layout and render inputs the checkpoint is valid for
+    chunk_size = models.PositiveIntegerField(default=0)
+    feed_hash = models.CharField(max_length=64, blank=True, default='')
+    render_hash = models.CharField(max_length=64, blank=True, default='')
+    done_chunks = models.JSONField(default=list)
+    # Chunks of the current attempt sent to the broker (0 when run inline)
+    dispatched_chunks = models.PositiveIntegerField(default=0)
+    # Feed entries completed without gaps from the start of the feed
+    checkpoint = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    # Run summary: stage timings, counters and failures by reason (app.metrics)
+    metrics = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Heartbeat: updated whenever a chunk starts or finishes
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            # The per-frame run lock
+            models.UniqueConstraint(
+                fields=['frame'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='one_active_job_per_frame',
+            ),
         ]
     
     def __str__(self):
-        return f"OutputImage for {self.frame.name} - {self.product_id} at {self.created_at}"
\ No newline at end of file
+        return f"Job {self.id} for {self.frame.name} ({self.status})"
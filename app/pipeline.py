@@ -0,0 +1,409 @@
+import os, time, queue, threading, logging, multiprocessing
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from io import BytesIO
+import django
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from .models import OutputImage
+from .fetching import fetch_image, prefetch_images
+from .metrics import RenderMetrics, timed, failure_reason
+from .rendering import (
+    composite_product, save_output_image, output_extension, remove_stale_outputs,
+    thumbnail_bytes, thumbnail_name, render_cost,
+)
+
+logger = logging.getLogger(__name__)
+
+RENDERED, SKIPPED, FAILED = 'rendered', 'skipped', 'failed'
+
+# Picklable subset of a Frame needed to render in another process
+RenderSpec = namedtuple('RenderSpec', [
+    'frame_path', 'coordinates', 'output_format', 'output_quality',
+    'png_compress_level', 'png_optimize', 'resample_mode',
+])
+
+
+def render_spec(frame):
+    return RenderSpec(
+        frame.image.path, frame.coordinates, frame.output_format, frame.output_quality,
+        frame.png_compress_level, frame.png_optimize, frame.resample_mode,
+    )
+
+
+def render_to_bytes(spec, content):
+    """Decode, composite and encode one product and its thumbnail; runs in
+    the render pool. Returns (output bytes, thumbnail bytes, stage timings)."""
+    timings = {}
+    image = composite_product(spec.frame_path, content, spec.coordinates, spec.resample_mode, timings)
+    encoded = BytesIO()
+    with timed(timings, 'encode'):
+        save_output_image(image, encoded, spec)
+    with timed(timings, 'thumbnail'):
+        thumbnail = thumbnail_bytes(image)
+    return encoded.getvalue(), thumbnail, timings
+
+
+def write_output_files(frame, product_id, content, thumbnail):
+    """Write an encoded output and its thumbnail under MEDIA_ROOT; returns
+    the (image, thumbnail) names relative to MEDIA_ROOT."""
+    output_dir = os.path.join(settings.MEDIA_ROOT, 'outputs', str(frame.id))
+    image_name = f"outputs/{frame.id}/{product_id}.{output_extension(frame)}"
+    thumb_name = thumbnail_name(frame.id, product_id)
+
+    with open(os.path.join(settings.MEDIA_ROOT, image_name), 'wb') as f:
+        f.write(content)
+    with open(os.path.join(settings.MEDIA_ROOT, thumb_name), 'wb') as f:
+        f.write(thumbnail)
+    remove_stale_outputs(output_dir, product_id, frame)
+    return image_name, thumb_name
+
+
+def output_dirs(frame):
+    output_dir = os.path.join(settings.MEDIA_ROOT, 'outputs', str(frame.id))
+    os.makedirs(os.path.join(output_dir, 'thumbs'), exist_ok=True)
+    return output_dir
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def process_pool(workers):
+    """Render processes started with spawn, each with Django set up."""
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup,
+    )
+
+
+def render_pool(kind, workers):
+    """A new render pool of processes or ('thread') threads."""
+    if kind == 'process':
+        return process_pool(workers)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render')
+
+
+def get_render_executor():
+    """Process-wide render pool, created on first use and reused across chunks.
+
+    Celery's prefork workers are daemonic and may not start child processes;
+    there (or with RENDER_POOL=thread) a thread pool is used instead. Pillow
+    releases the GIL while decoding, resizing and encoding, so threads still
+    spread the heavy work over several cores.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = settings.RENDER_WORKERS or os.cpu_count()
+            use_processes = settings.RENDER_POOL == 'process'
+            if use_processes and multiprocessing.current_process().daemon:
+                logger.info("Daemonic worker process, rendering with a thread pool")
+                use_processes = False
+            _executor = render_pool('process' if use_processes else 'thread', workers)
+        return _executor
+
+
+class MemoryBudget:
+    """Bounds the estimated bytes (see render_cost) of images being decoded
+    and rendered at once in a worker process.
+
+    acquire() blocks while the budget is used up. An image larger than the
+    whole budget is still let through once nothing else holds any of it, so
+    it cannot stall a run. exhausted() reports whether the last acquire()
+    had to wait, i.e. the budget rather than the downloads paces rendering.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.waited = False
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        """Reserve size bytes; returns the seconds spent waiting."""
+        if not self.max_bytes:
+            return 0.0
+        start = time.perf_counter()
+        with self._condition:
+            self.waited = bool(self.used and self.used + size > self.max_bytes)
+            while self.used and self.used + size > self.max_bytes:
+                self._condition.wait()
+            self.used += size
+        return time.perf_counter() - start
+
+    def exhausted(self):
+        return self.waited
+
+    def release(self, size):
+        if not self.max_bytes:
+            return
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+_budget = None
+
+
+def get_memory_budget():
+    """Process-wide budget shared by every chunk rendering in this worker."""
+    global _budget
+    with _executor_lock:
+        if _budget is None:
+            _budget = MemoryBudget(settings.RENDER_MEMORY_BUDGET_BYTES)
+        return _budget
+
+
+class RenderJob:
+    __slots__ = ('product_id', 'image_link', 'fetched', 'previous', 'result', 'error')
+
+    def __init__(self, product_id, image_link):
+        self.product_id = product_id
+        self.image_link = image_link
+        self.fetched = None
+        self.previous = None
+        self.result = None
+        self.error = None
+
+
+class RenderPipeline:
+    """Staged renderer for one batch of feed entries.
+
+    fetch threads (prefetch_images) -> render pool (decode/composite/encode)
+    -> writer thread (file write + buffered DB rows). At most queue_size
+    renders are in flight and at most queue_size encoded images wait for the
+    writer, so a slow CDN or disk stalls the stage before it instead of
+    growing memory. Products only enter the render pool within the worker's
+    MemoryBudget; while it is exhausted only one download is fetched ahead,
+    and a product's body is dropped once its render is submitted, so raw
+    bodies held outside the budget stay few. on_done(product_id, status) is called from the writer
+    thread once per product, in feed order. Stage timings, counters and
+    queue depths are recorded in metrics. executor replaces the process-wide
+    render pool and image_cache the shared image cache.
+    """
+
+    def __init__(self, frame, render_hash, outputs, on_done, queue_size=None, metrics=None, executor=None,
+                 image_cache=None):
+        self.frame = frame
+        self.spec = render_spec(frame)
+        self.size = (int(frame.coordinates.get('width', 100)), int(frame.coordinates.get('height', 100)))
+        self.render_hash = render_hash
+        self.outputs = outputs
+        self.on_done = on_done
+        self.queue_size = queue_size or settings.RENDER_QUEUE_SIZE
+        self.metrics = metrics or RenderMetrics()
+        self.executor = executor
+        self.image_cache = image_cache
+        self.error = None
+
+    def run(self, entries, unchanged=None, should_stop=None):
+        """Render entries; unchanged maps product_id to an OutputImage that
+        can be skipped if its source image has not been modified. Stops
+        taking new entries once should_stop() returns True; products already
+        in flight are still written. Returns False if it stopped early."""
+        entries = unique_entries(entries)
+        unchanged = unchanged or {}
+        validators = {
+            product_id: (output.source_etag, output.source_last_modified)
+            for product_id, output in unchanged.items()
+        }
+        output_dirs(self.frame)
+        executor = self.executor or get_render_executor()
+        self.budget = get_memory_budget()
+
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        writer = threading.Thread(target=self._write_loop, args=(write_queue,), name='render-writer')
+        writer.start()
+
+        in_flight = deque()
+        stopped = False
+        try:
+            downloads = prefetch_images(
+                entries, validators, metrics=self.metrics, cache=self.image_cache, budget=self.budget
+            )
+            for product_id, image_link, download in downloads:
+                if should_stop is not None and should_stop():
+                    stopped = True
+                    # Cancels the downloads queued behind this one
+                    downloads.close()
+                    break
+                in_flight.append(self._submit(executor, product_id, image_link, download, unchanged.get(product_id)))
+                self.metrics.sample_queue('render_in_flight', len(in_flight))
+                if len(in_flight) >= self.queue_size:
+                    self.metrics.sample_queue('write_queue', write_queue.qsize())
+                    write_queue.put(self._collect(in_flight.popleft()))
+            while in_flight:
+                write_queue.put(self._collect(in_flight.popleft()))
+        finally:
+            write_queue.put(None)
+            writer.join()
+
+        if self.error is not None:
+            raise self.error
+        return not stopped
+
+    def _submit(self, executor, product_id, image_link, download, previous):
+        job = RenderJob(product_id, image_link)
+        try:
+            job.fetched = download.result()
+            if previous is not None and (
+                job.fetched.not_modified or job.fetched.content_hash == previous.source_hash
+            ):
+                job.previous = previous
+            else:
+                job.result = self._render(executor, job.fetched.content)
+            # The render pool has its own reference; only the metadata is needed to write
+            job.fetched = job.fetched._replace(content=None)
+        except Exception as e:
+            job.error = e
+        return job
+
+    def _render(self, executor, content):
+        # Header-only check: oversized images fail here, before any decoding
+        cost = render_cost(content, self.size, self.spec.resample_mode)
+        waited = self.budget.acquire(cost)
+        if waited > 0.001:
+            self.metrics.add_time('memory_wait', waited)
+        try:
+            future = executor.submit(render_to_bytes, self.spec, content)
+        except Exception:
+            self.budget.release(cost)
+            raise
+        future.add_done_callback(lambda _: self.budget.release(cost))
+        return future
+
+    def _collect(self, job):
+        if job.result is not None:
+            try:
+                job.result = job.result.result()
+            except Exception as e:
+                job.error = e
+            else:
+                self.metrics.add_timings(job.result[2])
+        return job
+
+    def _write_loop(self, write_queue):
+        try:
+            while True:
+                job = write_queue.get()
+                if job is None:
+                    break
+                # After an error keep draining so the producer never blocks
+                if self.error is None:
+                    try:
+                        status = self._write(job)
+                        self.metrics.count(status)
+                        self.on_done(job.product_id, status)
+                    except Exception as e:
+                        self.error = e
+            if self.error is None:
+                self.outputs.flush()
+        except Exception as e:
+            self.error = e
+        finally:
+            # The writer thread has its own DB connection
+            connection.close()
+
+    def _write(self, job):
+        frame = self.frame
+        if job.previous is not None:
+            if not job.fetched.not_modified:
+                job.previous.source_etag = job.fetched.etag
+                job.previous.source_last_modified = job.fetched.last_modified
+                self.outputs.add_refreshed(job.previous)
+            return SKIPPED
+
+        if job.error is None:
+            try:
+                with self.metrics.timer('write'):
+                    image_name, thumb_name = write_output_files(frame, job.product_id, *job.result[:2])
+            except OSError as e:
+                job.error = e
+
+        if job.error is not None:
+            logger.error(f"Error processing product {job.product_id}: {job.error}")
+            self.metrics.failure(failure_reason(job.error))
+            self.outputs.add_failed(OutputImage(
+                frame=frame,
+                product_id=job.product_id,
+                product_image_url=job.image_link
+            ))
+            return FAILED
+
+        self.outputs.add_rendered(OutputImage(
+            frame=frame,
+            product_id=job.product_id,
+            product_image_url=job.image_link,
+            image=image_name,
+            thumbnail=thumb_name,
+            source_etag=job.fetched.etag,
+            source_last_modified=job.fetched.last_modified,
+            source_hash=job.fetched.content_hash,
+            render_hash=self.render_hash
+        ))
+        return RENDERED
+
+
+def unique_entries(entries):
+    """Entries with one (product_id, image_link) per product, the last link
+    winning like it does in unchanged_outputs; a product listed twice would
+    otherwise be rendered and upserted twice in the same batch."""
+    return list(dict(entries).items())
+
+
+def unchanged_outputs(frame, entries, render_hash):
+    """{product_id: OutputImage} of entries rendered with the same frame
+    inputs and image URL; they are re-rendered only if the image changed."""
+    image_links = dict(entries)
+    existing = OutputImage.objects.filter(frame=frame, product_id__in=image_links).exclude(image='')
+    return {
+        output.product_id: output for output in existing
+        if output.render_hash == render_hash
+        and output.product_image_url == image_links[output.product_id]
+    }
+
+
+def render_output_once(frame, product_id, image_link, render_hash):
+    """Render a single output in the calling thread (lazy mode).
+
+    Concurrent first requests for the same product are deduplicated with a
+    cache lock: one caller renders, the others wait up to LAZY_RENDER_WAIT
+    seconds and then read its result. Returns the up-to-date OutputImage, or
+    None if no render became available in time.
+    """
+    lock_key = f"lazy_render_{frame.id}_{product_id}"
+    if cache.add(lock_key, 1, settings.LAZY_RENDER_LOCK_TIMEOUT):
+        try:
+            fetched = fetch_image(image_link)
+            content, thumbnail, _ = render_to_bytes(render_spec(frame), fetched.content)
+            output_dirs(frame)
+            image_name, thumb_name = write_output_files(frame, product_id, content, thumbnail)
+
+            output, _ = OutputImage.objects.update_or_create(
+                frame=frame,
+                product_id=product_id,
+                defaults={
+                    'product_image_url': image_link,
+                    'image': image_name,
+                    'thumbnail': thumb_name,
+                    'source_etag': fetched.etag,
+                    'source_last_modified': fetched.last_modified,
+                    'source_hash': fetched.content_hash,
+                    'render_hash': render_hash,
+                }
+            )
+            return output
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + settings.LAZY_RENDER_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.2)
+        if cache.get(lock_key) is None:
+            break
+    return OutputImage.objects.filter(
+        frame=frame, product_id=product_id, render_hash=render_hash
+    ).exclude(image='').first()
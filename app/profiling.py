@@ -0,0 +1,111 @@
+import io, sys, pstats, cProfile, linecache, threading, tracemalloc
+
+MB = 1024 * 1024
+
+
+class ThreadProfiler:
+    """cProfile for the calling thread and every thread started while it is
+    active (image fetch threads, render pool, writer), merged by stats().
+
+    Threads that already existed when profiling started are not covered,
+    so pools must be created inside the block.
+    """
+
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def _profile_thread(self, *args):
+        # First profile event of a new thread: hand it its own profiler
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        profile.enable()
+
+    def __enter__(self):
+        threading.setprofile(self._profile_thread)
+        main = cProfile.Profile()
+        self.profiles.append(main)
+        main.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiles[0].disable()
+        threading.setprofile(None)
+
+    def stats(self, stream=None):
+        with self._lock:
+            profiles = list(self.profiles)
+        stats = pstats.Stats(profiles[0], stream=stream)
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+
+class AllocationTracker:
+    """tracemalloc session keeping snapshots from the start, the end and the
+    moment traced memory peaked (sampled every interval seconds)."""
+
+    def __init__(self, interval=1.0, frames=1):
+        self.interval = interval
+        self.frames = frames
+        self.start = self.peak = self.end = None
+        self.peak_size = 0
+        self.traced_peak = 0
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def __enter__(self):
+        tracemalloc.start(self.frames)
+        self.start = self._snapshot()
+        self._sampler = threading.Thread(target=self._sample, name='tracemalloc-sampler', daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._sampler.join()
+        self.end = self._snapshot()
+        current, self.traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if self.peak is None:
+            self.peak, self.peak_size = self.end, current
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            size = tracemalloc.get_traced_memory()[0]
+            if size > self.peak_size:
+                self.peak_size = size
+                self.peak = self._snapshot()
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces([
+            # Profiler and import machinery noise
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, linecache.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ])
+
+
+def format_stats(profiler, sort, top):
+    stream = io.StringIO()
+    profiler.stats(stream).sort_stats(sort).print_stats(top)
+    # Times are summed over all threads; idle pool threads show up as lock/queue waits
+    return "(lock acquire and queue get entries are threads waiting for work)\n" + stream.getvalue().strip()
+
+
+def format_allocations(tracker, top):
+    lines = [
+        f"Peak traced memory: {tracker.traced_peak / MB:.1f} MB "
+        f"(Pillow pixel buffers are allocated outside tracemalloc; see peak RSS)",
+        "",
+        f"Top {top} allocation sites at the sampled peak ({tracker.peak_size / MB:.1f} MB traced):",
+    ]
+    lines += [str(stat) for stat in tracker.peak.statistics('lineno')[:top]]
+    lines += ["", f"Top {top} allocation sites still held at the end, compared with the start:"]
+    lines += [str(stat) for stat in tracker.end.compare_to(tracker.start, 'lineno')[:top]]
+    return '\n'.join(lines)
@@ -0,0 +1,99 @@
+import time, logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# Counters and snapshots live in the shared cache so every worker sees them
+PROGRESS_TIMEOUT = 60 * 60 * 24
+
+
+def counter_key(frame_id):
+    return f"render_progress_{frame_id}"
+
+
+def snapshot_key(frame_id):
+    return f"render_progress_snapshot_{frame_id}"
+
+
+def send_progress(frame_id, data):
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        f"progress_{frame_id}",
+        {
+            "type": "progress_update",  # Buradaki type consumer metoduna karşılık gelmeli
+            "data": data
+        }
+    )
+
+
+def publish_progress(frame_id, data):
+    """Send an update and keep it as the snapshot for clients that join later."""
+    cache.set(snapshot_key(frame_id), data, PROGRESS_TIMEOUT)
+    send_progress(frame_id, data)
+
+
+def start_progress(frame_id, total, processed=0):
+    cache.set(counter_key(frame_id), processed, PROGRESS_TIMEOUT)
+    cache.set(snapshot_key(frame_id), {"processed": processed, "total": total}, PROGRESS_TIMEOUT)
+
+
+def finish_progress(frame_id, data):
+    """Send the final (completed or error) message and drop the run's state."""
+    cache.delete_many([counter_key(frame_id), snapshot_key(frame_id)])
+    send_progress(frame_id, data)
+
+
+class ProgressReporter:
+    """Coalesces per-product progress into at most one message per
+    PROGRESS_EVERY_ITEMS products or PROGRESS_INTERVAL seconds.
+
+    The shared counter is incremented by the batched delta on each emit, so
+    both Redis round-trips and WebSocket messages scale with the emit rate
+    rather than with the number of products.
+    """
+
+    def __init__(self, frame_id, total, every=None, interval=None):
+        self.frame_id = frame_id
+        self.total = total
+        self.every = every or settings.PROGRESS_EVERY_ITEMS
+        self.interval = interval if interval is not None else settings.PROGRESS_INTERVAL
+        self.pending_processed = 0
+        self.pending_items = 0
+        self.product_id = None
+        self.last_emit = time.monotonic()
+
+    def advance(self, product_id, processed=True):
+        if processed:
+            self.pending_processed += 1
+        self.pending_items += 1
+        self.product_id = product_id
+        if self.pending_items >= self.every or time.monotonic() - self.last_emit >= self.interval:
+            self.emit()
+
+    def emit(self):
+        if not self.pending_items:
+            return
+        try:
+            if self.pending_processed:
+                processed = cache.incr(counter_key(self.frame_id), self.pending_processed)
+            else:
+                processed = cache.get(counter_key(self.frame_id), 0)
+        except ValueError:
+            # Counter gone: the run was finished or restarted elsewhere
+            logger.warning(f"Progress counter for frame {self.frame_id} is missing")
+            processed = None
+
+        self.pending_processed = 0
+        self.pending_items = 0
+        self.last_emit = time.monotonic()
+        if processed is None:
+            return
+
+        publish_progress(self.frame_id, {
+            "processed": processed,
+            "total": self.total,
+            "product_id": self.product_id
+        })
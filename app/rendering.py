@@ -0,0 +1,241 @@
+import os, json, hashlib, threading, logging
+from collections import OrderedDict
+from functools import lru_cache
+from io import BytesIO
+from PIL import Image
+from django.conf import settings
+from .metrics import timed
+
+logger = logging.getLogger(__name__)
+
+
+class FrameTemplateCache:
+    """Per-process LRU cache of decoded RGBA frame templates.
+
+    Entries are keyed by path, mtime and size, so replacing a frame image
+    (edit_frame) produces a new key and the stale template simply ages out.
+    Eviction is bounded by the decoded size in bytes, not the entry count.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, frame_path):
+        stat = os.stat(frame_path)
+        key = (os.path.abspath(frame_path), stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            template = self._entries.get(key)
+            if template is not None:
+                self._entries.move_to_end(key)
+                return template
+
+        with Image.open(frame_path) as image:
+            template = image.convert("RGBA")
+        template.load()
+        self._store(key, template)
+        return template
+
+    def invalidate(self, frame_path):
+        path = os.path.abspath(frame_path)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == path]:
+                self._bytes -= self._size(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _store(self, key, template):
+        size = self._size(template)
+        if size > self.max_bytes:
+            logger.warning(f"Frame template {key[0]} ({size} bytes) exceeds cache budget, not cached")
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            # Drop older versions of the same file right away
+            for stale in [k for k in self._entries if k[0] == key[0]]:
+                self._bytes -= self._size(self._entries.pop(stale))
+            self._entries[key] = template
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self._size(evicted)
+
+    @staticmethod
+    def _size(image):
+        return image.width * image.height * len(image.getbands())
+
+
+frame_templates = FrameTemplateCache(settings.FRAME_TEMPLATE_CACHE_BYTES)
+
+
+def load_frame_template(frame_path):
+    """Return a private, writable RGBA copy of the cached frame template."""
+    return frame_templates.get(frame_path).copy()
+
+
+# Final resample filter and Pillow reducing_gap per frame resample_mode: the
+# source is first shrunk with reduce() to within reducing_gap x the target
+RESAMPLE_MODES = {
+    'quality': (Image.Resampling.LANCZOS, 3.0),
+    'balanced': (Image.Resampling.BICUBIC, 2.0),
+    'fast': (Image.Resampling.BILINEAR, 1.0),
+}
+
+
+class ImageTooLarge(ValueError):
+    """A product image that would decode to more than IMAGE_MAX_PIXELS."""
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def open_product_image(product_content, size, reducing_gap):
+    """Open a product image, reading only its header, and set up JPEG draft
+    decoding. Raises ImageTooLarge before any pixels are decoded if the image
+    would exceed IMAGE_MAX_PIXELS."""
+    width, height = size
+    image = Image.open(BytesIO(product_content))
+    if image.format == 'JPEG':
+        image.draft('RGB', (int(width * reducing_gap), int(height * reducing_gap)))
+    if settings.IMAGE_MAX_PIXELS and image.width * image.height > settings.IMAGE_MAX_PIXELS:
+        raise ImageTooLarge(
+            f"Product image is {image.width}x{image.height} pixels, "
+            f"over the {settings.IMAGE_MAX_PIXELS} pixel limit"
+        )
+    return image
+
+
+def render_cost(product_content, size, resample_mode='quality'):
+    """Rough peak bytes of rendering a product: its encoded bytes plus its
+    decoded and resized pixels. Reads only the image header."""
+    _, reducing_gap = RESAMPLE_MODES.get(resample_mode, RESAMPLE_MODES['quality'])
+    image = open_product_image(product_content, size, reducing_gap)
+    return len(product_content) + 4 * (image.width * image.height + size[0] * size[1])
+
+
+def load_product_image(product_content, size, resample_mode='quality', timings=None):
+    """Decode a product image and resize it to size, cheaply.
+
+    JPEGs are decoded with draft() at the smallest DCT scale that still
+    covers reducing_gap x the target, reduce() does the bulk of the
+    downscale, and only the final step uses the selected filter. Opaque
+    sources stay RGB instead of being expanded to RGBA. Images over
+    IMAGE_MAX_PIXELS are rejected from their header. Decode and resize
+    times are added to timings when given.
+    """
+    resample, reducing_gap = RESAMPLE_MODES.get(resample_mode, RESAMPLE_MODES['quality'])
+
+    with timed(timings, 'decode'):
+        image = open_product_image(product_content, size, reducing_gap)
+        image.load()
+
+        mode = 'RGBA' if has_alpha(image) else 'RGB'
+        if image.mode != mode:
+            image = image.convert(mode)
+    with timed(timings, 'resize'):
+        return image.resize(size, resample, reducing_gap=reducing_gap)
+
+
+def composite_product(frame_path, product_content, coordinates, resample_mode='quality', timings=None):
+    with timed(timings, 'composite'):
+        frame = load_frame_template(frame_path)
+
+    x = int(coordinates.get('x', 0))
+    y = int(coordinates.get('y', 0))
+    width = int(coordinates.get('width', 100))
+    height = int(coordinates.get('height', 100))
+
+    resized_product = load_product_image(product_content, (width, height), resample_mode, timings)
+    final_x = max(0, min(x, frame.size[0] - width))
+    final_y = max(0, min(y, frame.size[1] - height))
+    # Opaque products need no alpha mask
+    mask = resized_product if resized_product.mode == 'RGBA' else None
+    with timed(timings, 'composite'):
+        frame.paste(resized_product, (final_x, final_y), mask)
+    return frame
+
+
+def file_hash(path):
+    stat = os.stat(path)
+    return _file_hash(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+@lru_cache(maxsize=256)
+def _file_hash(path, mtime_ns, size):
+    # mtime and size are part of the cache key so a replaced file is re-hashed
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def output_settings(frame):
+    return {
+        'format': frame.output_format,
+        'quality': frame.output_quality,
+        'png_compress_level': frame.png_compress_level,
+        'png_optimize': frame.png_optimize,
+        'resample_mode': frame.resample_mode,
+    }
+
+
+def render_fingerprint(frame):
+    """Hash of everything frame-side that affects a rendered output."""
+    geometry = {key: frame.coordinates.get(key) for key in ('x', 'y', 'width', 'height')}
+    payload = json.dumps({
+        'frame_image': file_hash(frame.image.path),
+        'coordinates': geometry,
+        'output': output_settings(frame),
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+OUTPUT_EXTENSIONS = {'png': 'png', 'webp': 'webp', 'jpeg': 'jpg'}
+
+
+def output_extension(frame):
+    return OUTPUT_EXTENSIONS.get(frame.output_format, 'png')
+
+
+def save_output_image(image, fp, frame):
+    """Encode a rendered RGBA composite with the frame's output settings."""
+    if frame.output_format == 'jpeg':
+        # JPEG has no alpha channel: flatten onto white
+        flattened = Image.new('RGB', image.size, (255, 255, 255))
+        flattened.paste(image, mask=image.getchannel('A'))
+        flattened.save(fp, format='JPEG', quality=frame.output_quality, progressive=True, optimize=True)
+    elif frame.output_format == 'webp':
+        image.save(fp, format='WEBP', quality=frame.output_quality, method=4)
+    else:
+        image.save(fp, format='PNG', optimize=frame.png_optimize, compress_level=frame.png_compress_level)
+
+
+def remove_stale_outputs(output_dir, product_id, frame):
+    """Delete renders of this product left over from a previous output format."""
+    current = output_extension(frame)
+    for extension in set(OUTPUT_EXTENSIONS.values()) - {current}:
+        stale_path = os.path.join(output_dir, f"{product_id}.{extension}")
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+
+
+def thumbnail_bytes(image):
+    """Small WebP preview of a rendered composite for listing pages."""
+    thumbnail = image.copy()
+    thumbnail.thumbnail((settings.THUMBNAIL_SIZE, settings.THUMBNAIL_SIZE), Image.Resampling.BICUBIC, reducing_gap=2.0)
+    encoded = BytesIO()
+    thumbnail.save(encoded, format='WEBP', quality=settings.THUMBNAIL_QUALITY)
+    return encoded.getvalue()
+
+
+def thumbnail_name(frame_id, product_id):
+    return f"outputs/{frame_id}/thumbs/{product_id}.webp"
@@ -1,36 +1,111 @@
-from celery import shared_task
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-from .models import Frame, OutputImage
-from PIL import Image
-import os, requests, logging
-from io import BytesIO
+from celery import shared_task, chord
+from celery.signals import worker_ready
+from .models import Frame, OutputImage, ProcessingJob
+from .utils import iter_entry_chunks
+from .rendering import composite_product, render_fingerprint
+from .fetching import fetch_bytes
+from .pipeline import RenderPipeline, unchanged_outputs, unique_entries, RENDERED, SKIPPED, FAILED
+from .progress import ProgressReporter, start_progress, publish_progress, finish_progress
+from .deletion import selected_outputs, delete_outputs, remove_output_dir, remove_media_file
+from .listing import invalidate_output_count
+from .metrics import RenderMetrics, publish_worker_metrics, stage_summary
+from .jobs import (
+    QUEUED, COMPLETED, FAILED as FAILED_JOB, CancelCheck, start_job, claim_job, begin_attempt,
+    record_chunk, heartbeat, finish_job, stale_jobs, active_job, is_rendering, mark_dispatched,
+    run_task_id, chunk_task_id,
+)
+import os, logging
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
+# Waiting for a cancelled run's chunks before deleting a frame (5 minutes)
+DELETE_RETRY_SECONDS = 10
+DELETE_MAX_RETRIES = 30
+
 def overlay_images(frame_path, product_image_url, coordinates):
-    frame = Image.open(frame_path).convert("RGBA")
-    response = requests.get(product_image_url)
-    response.raise_for_status()
-    product_image = Image.open(BytesIO(response.content)).convert("RGBA")
-
-    x = int(coordinates.get('x', 0))
-    y = int(coordinates.get('y', 0))
-    width = int(coordinates.get('width', 100))
-    height = int(coordinates.get('height', 100))
-
-    resized_product = product_image.resize((width, height), Image.Resampling.LANCZOS)
-    final_x = max(0, min(x, frame.size[0] - width))
-    final_y = max(0, min(y, frame.size[1] - height))
-    frame.paste(resized_product, (final_x, final_y), resized_product)
-    return frame
-
-@shared_task(bind=True)
-def process_feed_entries(self, frame_id):
+    metrics = RenderMetrics()
+    with metrics.timer('fetch'):
+        content = fetch_bytes(product_image_url)
+    timings = {}
+    image = composite_product(frame_path, content, coordinates, timings=timings)
+    metrics.add_timings(timings)
+    publish_worker_metrics(metrics)
+    return image
+
+class OutputBuffer:
+    """Collects OutputImage rows and writes them with one query per batch.
+
+    Rendered rows are upserted on (frame, product_id) so re-runs update in
+    place; failure placeholders are only inserted when no row exists yet, so
+    an earlier successful render is never clobbered. Rows are keyed by
+    product_id and the last one wins, since one upsert statement cannot
+    touch the same row twice.
+    """
+
+    RENDER_FIELDS = [
+        'product_image_url', 'image', 'thumbnail', 'source_etag', 'source_last_modified',
+        'source_hash', 'render_hash',
+    ]
+    VALIDATOR_FIELDS = ['source_etag', 'source_last_modified']
+
+    def __init__(self, batch_size=None, metrics=None):
+        self.batch_size = batch_size or settings.OUTPUT_WRITE_BATCH_SIZE
+        self.metrics = metrics or RenderMetrics()
+        self.rendered = {}
+        self.failed = {}
+        self.refreshed = {}
+
+    def add_rendered(self, output):
+        self.rendered[output.product_id] = output
+        self._maybe_flush()
+
+    def add_failed(self, output):
+        self.failed[output.product_id] = output
+        self._maybe_flush()
+
+    def add_refreshed(self, output):
+        self.refreshed[output.product_id] = output
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self.rendered) + len(self.failed) + len(self.refreshed) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        rows = len(self.rendered) + len(self.failed) + len(self.refreshed)
+        if rows:
+            with self.metrics.timer('db'):
+                self._write()
+            self.metrics.count('db_rows', rows)
+        self.rendered, self.failed, self.refreshed = {}, {}, {}
+
+    def _write(self):
+        if self.rendered:
+            OutputImage.objects.bulk_create(
+                list(self.rendered.values()),
+                update_conflicts=True,
+                unique_fields=['frame', 'product_id'],
+                update_fields=self.RENDER_FIELDS,
+            )
+        if self.failed:
+            OutputImage.objects.bulk_create(list(self.failed.values()), ignore_conflicts=True)
+        if self.refreshed:
+            OutputImage.objects.bulk_update(list(self.refreshed.values()), self.VALIDATOR_FIELDS)
+
+# track_started: jobs.waiting_for_worker tells queued tasks from started ones
+@shared_task(bind=True, track_started=True)
+def process_feed_entries(self, frame_id, incremental=True, job_id=None):
+    """Coordinator: parse the feed once and fan the entries out in chunks.
+
+    With incremental=True, products whose inputs are unchanged since their
+    last render are skipped (see render_feed_chunk). The run is tracked by a
+    ProcessingJob; without job_id one is created, unless another run of the
+    frame is active. A resumed job only dispatches the chunks its earlier
+    attempts did not finish.
+    """
     logger.info(f"Starting process_feed_entries for frame {frame_id}")
-    channel_layer = get_channel_layer()
-    group_name = f"progress_{frame_id}"
+    job = None
 
     try:
         frame = Frame.objects.get(id=frame_id)
@@ -38,69 +113,263 @@ def process_feed_entries(self, frame_id):
             logger.error(f"No coordinates set for frame {frame_id}")
             return
 
+        if job_id is None:
+            job, created = start_job(frame, incremental)
+            if not created:
+                logger.warning(f"Frame {frame_id} already has an active job, not starting another run")
+                return
+        else:
+            job = ProcessingJob.objects.get(id=job_id)
+            if job.status != QUEUED:
+                logger.info(f"Job {job_id} is {job.status}, not starting it")
+                return
+
+        if frame.has_local_feed:
+            raise ValueError(f"Feed {frame.xmlFeedPath} is a local file, render it with the render_feed command")
+
         output_dir = os.path.join(settings.MEDIA_ROOT, 'outputs', str(frame_id))
         os.makedirs(output_dir, exist_ok=True)
 
-        response = requests.get(frame.xmlFeedPath)
-        response.raise_for_status()
-
-        from xml.etree import ElementTree
-        tree = ElementTree.fromstring(response.content)
-        namespace = {'atom': 'http://www.w3.org/2005/Atom'}
-        entries = tree.findall('atom:entry', namespace)
-        total_products = len(entries)
-        processed_count = 0
-
-        for i, entry in enumerate(entries):
-            product_id_elem = entry.find('atom:id', namespace)
-            image_link_elem = entry.find('atom:image_link', namespace)
-            if product_id_elem is None or image_link_elem is None:
-                continue
-            product_id = product_id_elem.text
-            image_link = image_link_elem.text
-
-            try:
-                output_image = overlay_images(frame.image.path, image_link, frame.coordinates)
-                output_path = os.path.join(output_dir, f"{product_id}.png")
-                output_image.save(output_path)
-                relative_path = f"outputs/{frame_id}/{product_id}.png"
-                OutputImage.objects.create(
-                    frame=frame,
-                    product_id=product_id,
-                    product_image_url=image_link,
-                    image=relative_path
-                )
-                processed_count += 1
-            except Exception as e:
-                logger.error(f"Error processing product {product_id}: {e}")
-                OutputImage.objects.create(
-                    frame=frame,
-                    product_id=product_id,
-                    product_image_url=image_link
-                )
-
-            # Send WebSocket progress update
-            async_to_sync(channel_layer.group_send)(
-                f"progress_{frame_id}",
-                {
-                    "type": "progress_update",  # Buradaki type consumer metoduna karşılık gelmeli
-                    "data": {
-                        "processed": processed_count,
-                        "total": total_products,
-                        "product_id": product_id
-                    }
-                }
-            )
+        # The feed is streamed; only the small (product_id, image_link) pairs are kept
+        chunk_size = job.chunk_size or max(1, settings.RENDER_CHUNK_SIZE)
+        feed_metrics = RenderMetrics()
+        with feed_metrics.timer('feed'):
+            # A product listed twice in a chunk is rendered once, so the totals add up
+            chunks = [unique_entries(chunk) for chunk in iter_entry_chunks(frame.xmlFeedPath, chunk_size)]
+        total_products = sum(len(chunk) for chunk in chunks)
+        feed_metrics.count('feed_entries', total_products)
+        publish_worker_metrics(feed_metrics)
 
-        logger.info(f"Processing completed. {processed_count}/{total_products} products processed successfully.")
+        render_hash = render_fingerprint(frame)
+        pending = begin_attempt(job, chunks, chunk_size, render_hash, feed_metrics.as_dict())
+        start_progress(frame_id, total_products, processed=job.processed)
+        logger.info(
+            f"Dispatching {sum(len(chunks[i]) for i in pending)} of {total_products} products "
+            f"in {len(pending)} chunks for frame {frame_id} (job {job.id})"
+        )
+
+        if self.request.called_directly or not pending:
+            # Synchronous fallback (no broker available) or nothing left: run inline
+            results = [
+                render_feed_chunk(frame_id, chunks[i], total_products, render_hash, job.incremental, job.id, job.attempt, i)
+                for i in pending
+            ]
+            return finalize_feed_run(results, frame_id, total_products, job.id, job.attempt)
+
+        callback = finalize_feed_run.s(frame_id, total_products, job.id, job.attempt)
+        # A failed chunk fails the chord, so finalize_feed_run never runs
+        callback.link_error(fail_feed_run.s(frame_id, job.id, job.attempt))
+        # Known task ids, so a run waiting in the broker is not taken for a dead one
+        mark_dispatched(job, len(chunks))
+        chord(
+            render_feed_chunk.s(
+                frame_id, chunks[i], total_products, render_hash, job.incremental, job.id, job.attempt, i
+            ).set(task_id=chunk_task_id(job.id, job.attempt, i))
+            for i in pending
+        )(callback)
     except Exception as e:
         logger.error(f"Fatal error processing frame {frame_id}: {e}")
-        async_to_sync(channel_layer.group_send)(
-            f"progress_{frame_id}",
-            {
-                "type": "progress_update",
-                "data": {
-                    "error": str(e)
-                }
-            }
-        )
\ No newline at end of file
+        if job is not None:
+            finish_job(job.id, job.attempt, FAILED_JOB, str(e))
+        finish_progress(frame_id, {"error": str(e)})
+
+@shared_task(track_started=True)
+def render_feed_chunk(frame_id, entries, total_products, render_hash, incremental=True,
+                      job_id=None, attempt=0, chunk_index=None):
+    """Render one chunk of (product_id, image_link) pairs.
+
+    The chunk's stage timings and counters are returned under "metrics",
+    added to the job's run summary and published with this worker's totals.
+    """
+    counts = {RENDERED: 0, SKIPPED: 0, FAILED: 0}
+    should_stop = CancelCheck(job_id, attempt, frame_id=frame_id)
+    if should_stop() or (job_id is not None and not heartbeat(job_id, attempt)):
+        # Cancelled, or this attempt was failed or superseded by a resume
+        return {"processed": 0, "skipped": 0, "failed": 0, "cancelled": True}
+
+    try:
+        frame = Frame.objects.get(id=frame_id)
+    except Frame.DoesNotExist:
+        logger.error(f"Frame {frame_id} disappeared before chunk could run")
+        return {"processed": 0, "skipped": 0, "failed": len(entries)}
+
+    # Outputs whose render inputs are unchanged only need a conditional GET
+    unchanged = unchanged_outputs(frame, entries, render_hash) if incremental else {}
+
+    metrics = RenderMetrics()
+    outputs = OutputBuffer(metrics=metrics)
+    progress = ProgressReporter(frame_id, total_products)
+
+    def product_done(product_id, status):
+        counts[status] += 1
+        # Coalesced WebSocket progress update
+        progress.advance(product_id, processed=status != FAILED)
+
+    # fetch threads -> render pool -> file/DB writer, connected by bounded queues
+    pipeline = RenderPipeline(frame, render_hash, outputs, product_done, metrics=metrics)
+    completed = pipeline.run(entries, unchanged, should_stop)
+    progress.emit()
+    publish_worker_metrics(metrics)
+    result = {
+        "processed": counts[RENDERED] + counts[SKIPPED],
+        "skipped": counts[SKIPPED],
+        "failed": counts[FAILED],
+        "metrics": metrics.as_dict(),
+    }
+    if not completed:
+        result["cancelled"] = True
+    elif job_id is not None:
+        # Only whole chunks count towards the checkpoint
+        record_chunk(job_id, attempt, chunk_index, result)
+    return result
+
+@shared_task
+def finalize_feed_run(results, frame_id, total_products, job_id=None, attempt=0):
+    """Chord callback: aggregate chunk results and report completion."""
+    if job_id is not None:
+        if not finish_job(job_id, attempt, COMPLETED):
+            # Cancelled (already reported) or superseded by a resumed attempt
+            logger.info(f"Job {job_id} attempt {attempt} ended without completing")
+            return None
+        job = ProcessingJob.objects.get(id=job_id)
+        processed_count, skipped_count, failed_count = job.processed, job.skipped, job.failed
+        run_metrics = job.metrics
+    else:
+        processed_count = sum(result["processed"] for result in results)
+        skipped_count = sum(result["skipped"] for result in results)
+        failed_count = sum(result["failed"] for result in results)
+        merged = RenderMetrics()
+        for result in results:
+            merged.merge(result.get("metrics", {}))
+        run_metrics = merged.as_dict()
+
+    logger.info(
+        f"Processing completed. {processed_count}/{total_products} products processed successfully "
+        f"({skipped_count} unchanged)."
+    )
+    stages = ", ".join(f"{stage} {seconds}s ({share}%)" for stage, seconds, share in stage_summary(run_metrics))
+    if stages:
+        logger.info(f"Frame {frame_id} stage times: {stages}")
+    if run_metrics.get("failures"):
+        logger.info(f"Frame {frame_id} failures by reason: {run_metrics['failures']}")
+    invalidate_output_count(frame_id)
+    finish_progress(frame_id, {
+        "processed": processed_count,
+        "skipped": skipped_count,
+        "failed": failed_count,
+        "total": total_products,
+        "completed": True
+    })
+    return {"processed": processed_count, "skipped": skipped_count, "failed": failed_count, "total": total_products}
+
+@shared_task
+def fail_feed_run(request, exc, traceback, frame_id, job_id, attempt):
+    """Chord errback: mark the run failed when a chunk raised. Chunks that
+    finished are checkpointed, so Resume picks up from there."""
+    logger.error(f"Render run of frame {frame_id} failed: {exc}")
+    if finish_job(job_id, attempt, FAILED_JOB, str(exc)):
+        invalidate_output_count(frame_id)
+        finish_progress(frame_id, {"error": str(exc)})
+
+def resume_job(job):
+    """Re-dispatch an interrupted job from its checkpoint; False if it
+    could not be claimed."""
+    if not claim_job(job):
+        return False
+    dispatch_run(job)
+    return True
+
+
+def dispatch_run(job):
+    """Queue the coordinator of a queued job under its known task id."""
+    process_feed_entries.apply_async((job.frame_id, job.incremental, job.id), task_id=run_task_id(job.id, job.attempt))
+
+@worker_ready.connect
+def resume_stale_jobs(**kwargs):
+    """Pick up runs whose worker died, e.g. across a worker restart."""
+    for job in stale_jobs():
+        if resume_job(job):
+            logger.info(f"Resumed stale job {job.id} of frame {job.frame_id}")
+
+@shared_task
+def index_feed_entries(frame_id):
+    """Lazy mode: register every feed product as an OutputImage row without
+    rendering it. Images are rendered on first request (views.render_output)."""
+    logger.info(f"Starting index_feed_entries for frame {frame_id}")
+
+    try:
+        frame = Frame.objects.get(id=frame_id)
+        if frame.has_local_feed:
+            raise ValueError(f"Feed {frame.xmlFeedPath} is a local file and cannot be indexed")
+        total_products = 0
+
+        for chunk in iter_entry_chunks(frame.xmlFeedPath, settings.OUTPUT_WRITE_BATCH_SIZE):
+            image_links = dict(chunk)
+            total_products += len(chunk)
+
+            # A product whose image URL changed must be rendered again
+            moved = []
+            for output in OutputImage.objects.filter(frame=frame, product_id__in=image_links):
+                image_link = image_links.pop(output.product_id)
+                if output.product_image_url != image_link:
+                    output.product_image_url = image_link
+                    output.image = ''
+                    output.thumbnail = ''
+                    moved.append(output)
+            OutputImage.objects.bulk_update(moved, ['product_image_url', 'image', 'thumbnail'])
+            OutputImage.objects.bulk_create([
+                OutputImage(frame=frame, product_id=product_id, product_image_url=image_link)
+                for product_id, image_link in image_links.items()
+            ], ignore_conflicts=True)
+
+        logger.info(f"Indexed {total_products} products for lazy rendering of frame {frame_id}")
+        invalidate_output_count(frame_id)
+        finish_progress(frame_id, {
+            "processed": total_products,
+            "total": total_products,
+            "completed": True
+        })
+    except Exception as e:
+        logger.error(f"Fatal error indexing frame {frame_id}: {e}")
+        finish_progress(frame_id, {"error": str(e)})
+
+@shared_task(bind=True, max_retries=DELETE_MAX_RETRIES)
+def delete_frame_data(self, frame_id):
+    """Delete a frame marked for deletion together with all of its outputs.
+
+    Chunks of a cancelled run finish the products they have in flight, so
+    this retries while the frame has an active job or a rendering lease (see
+    jobs.is_rendering); after DELETE_MAX_RETRIES it deletes regardless.
+    """
+    try:
+        frame = Frame.objects.get(id=frame_id)
+    except Frame.DoesNotExist:
+        return 0
+
+    if self.request.retries < DELETE_MAX_RETRIES and (active_job(frame) is not None or is_rendering(frame_id)):
+        logger.info(f"Frame {frame_id} is still rendering, deleting it later")
+        raise self.retry(countdown=DELETE_RETRY_SECONDS)
+
+    remove_output_dir(frame_id)
+    # The outputs directory held every render and thumbnail
+    deleted = delete_outputs(OutputImage.objects.filter(frame_id=frame_id), remove_files=False)
+    remove_media_file(frame.image.name)
+    # No outputs are left, so the cascade has nothing to load
+    frame.delete()
+    logger.info(f"Deleted frame {frame_id} and {deleted} outputs")
+    return deleted
+
+@shared_task
+def delete_frame_outputs(frame_id, output_ids=None, search_value=''):
+    """Bulk-delete outputs of a frame, reporting progress over the WebSocket."""
+    outputs = selected_outputs(frame_id, output_ids, search_value)
+    total = outputs.count()
+
+    def report(deleted):
+        publish_progress(frame_id, {"deleting": True, "deleted": deleted, "total": total})
+
+    deleted = delete_outputs(outputs, report)
+    invalidate_output_count(frame_id)
+    logger.info(f"Deleted {deleted} outputs of frame {frame_id}")
+    finish_progress(frame_id, {"deleting": True, "deleted": deleted, "total": total, "completed": True})
+    return deleted
@@ -9,11 +9,19 @@ urlpatterns = [
     path('register/', views.register, name='register'),
     path('add-frame/', views.add_frame, name='add_frame'),
     path('frame/<int:frame_id>/preview/', views.preview_frame, name='preview_frame'),
+    path('frame/<int:frame_id>/feed-images/', views.feed_images_ajax, name='feed_images_ajax'),
     path('frame/<int:frame_id>/edit/', views.edit_frame, name='edit_frame'),
     path('frame/<int:frame_id>/delete/', views.delete_frame, name='delete_frame'),
     path('frame_detail/<int:frame_id>/', views.frame_detail, name='frame_detail'),
     path('frame/<int:frame_id>/outputs-ajax/', views.frame_outputs_ajax, name='frame_outputs_ajax'),
+    path('frame/<int:frame_id>/outputs/bulk-delete/', views.bulk_delete_outputs, name='bulk_delete_outputs'),
+    path('frame/<int:frame_id>/cancel/', views.cancel_render, name='cancel_render'),
+    path('frame/<int:frame_id>/resume/', views.resume_render, name='resume_render'),
+    path('frame/<int:frame_id>/export/', views.export_outputs, name='export_outputs'),
+    path('frame/<int:frame_id>/render/<str:product_id>/', views.render_output, name='render_output'),
+    path('output/<int:output_id>/thumbnail/', views.output_thumbnail, name='output_thumbnail'),
     path('delete_output/<int:output_id>/', views.delete_output, name='delete_output'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
 
 
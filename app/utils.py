@@ -1,38 +1,178 @@
-import requests
+import os, json, time, hashlib, tempfile, logging
+from itertools import islice
 from xml.etree import ElementTree
+from django.conf import settings
+from .fetch_policy import policy_get, iter_limited
 
-def parse_feed_and_get_first_image(feed_url):
-    response = requests.get(feed_url)
-    response.raise_for_status()
-
-    tree = ElementTree.fromstring(response.content)
-    
-    # Define namespace for Atom feed
-    namespace = {'atom': 'http://www.w3.org/2005/Atom'}
-    
-    first_entry = tree.find('atom:entry', namespace)
-    if first_entry is not None:
-        image_link = first_entry.find('atom:image_link', namespace)
-        if image_link is not None:
-            return image_link.text
+logger = logging.getLogger(__name__)
+
+ATOM_NS = 'http://www.w3.org/2005/Atom'
+ENTRY_TAG = f'{{{ATOM_NS}}}entry'
+ID_TAG = f'{{{ATOM_NS}}}id'
+IMAGE_LINK_TAG = f'{{{ATOM_NS}}}image_link'
+
+FEED_CHUNK_BYTES = 64 * 1024
+
+def feed_cache_paths(feed_url):
+    key = hashlib.sha256(feed_url.encode()).hexdigest()
+    cache_dir = os.path.join(settings.FEED_CACHE_DIR, key[:2])
+    return os.path.join(cache_dir, f'{key}.xml'), os.path.join(cache_dir, f'{key}.json')
+
+def read_feed_cache_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def iter_cached_file(path):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(FEED_CHUNK_BYTES), b''):
+            yield chunk
+
+def iter_feed_bytes(feed_url):
+    """Yield the raw feed body in chunks, reading through the shared feed cache.
+
+    Feeds are cached on the media volume (shared by web and workers) keyed by
+    URL. A copy younger than FEED_CACHE_TTL is served as is; an older one is
+    revalidated with If-None-Match/If-Modified-Since so an unchanged feed
+    costs a 304. Fresh downloads are streamed to the caller while being
+    written to a temp file, which replaces the cached copy only once the
+    whole body has been read. Bodies over FEED_MAX_BYTES are abandoned.
+    """
+    data_path, meta_path = feed_cache_paths(feed_url)
+    meta = read_feed_cache_meta(meta_path) if os.path.exists(data_path) else None
+
+    if meta and time.time() - meta['fetched_at'] < settings.FEED_CACHE_TTL:
+        yield from iter_cached_file(data_path)
+        return
+
+    headers = {}
+    if meta:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    with policy_get(feed_url, headers, stream=True) as response:
+        if meta and response.status_code == 304:
+            meta['fetched_at'] = time.time()
+            write_feed_cache_meta(meta_path, meta)
+            yield from iter_cached_file(data_path)
+            return
+        response.raise_for_status()
+
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(data_path), suffix='.part')
+        complete = False
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in iter_limited(response, settings.FEED_MAX_BYTES, FEED_CHUNK_BYTES):
+                    tmp.write(chunk)
+                    yield chunk
+            os.replace(tmp_path, data_path)
+            complete = True
+            write_feed_cache_meta(meta_path, {
+                'url': feed_url,
+                'etag': response.headers.get('ETag', ''),
+                'last_modified': response.headers.get('Last-Modified', ''),
+                'fetched_at': time.time(),
+            })
+        finally:
+            # Caller stopped early (e.g. first image only): don't cache a partial body
+            if not complete and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def write_feed_cache_meta(meta_path, meta):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(meta_path), suffix='.part')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
 
+def iter_feed_entries(feed_url):
+    """Stream (product_id, image_link) records from an Atom feed.
+
+    The body (see iter_feed_bytes) is fed to an incremental parser chunk by
+    chunk and each <entry> is cleared once read, so memory stays flat
+    regardless of feed size and the first records are available before the
+    download has finished.
+    Missing fields are yielded as None.
+    """
+    yield from iter_feed_stream(iter_feed_bytes(feed_url))
+
+def iter_feed_stream(chunks):
+    """Incrementally parse an iterable of feed byte chunks (see iter_feed_entries)."""
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    root = None
+    depth = 0
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == 'start':
+                if root is None:
+                    root = elem
+                depth += 1
+                continue
+
+            depth -= 1
+            # Only top-level entries (direct children of <feed>)
+            if elem.tag != ENTRY_TAG or depth != 1:
+                continue
+            product_id = elem.findtext(ID_TAG)
+            image_link = elem.findtext(IMAGE_LINK_TAG)
+            elem.clear()
+            # Drop the finished entry from the root so it can be collected
+            root.remove(elem)
+            yield product_id, image_link
+
+    parser.close()
+
+def parse_feed_and_get_first_image(feed_url):
+    # Stops reading the stream as soon as the first entry is parsed
+    for _, image_link in iter_feed_entries(feed_url):
+        return image_link
     return None
 
-def parse_feed_and_get_images(feed_url):
-    response = requests.get(feed_url)
-    response.raise_for_status()
-
-    tree = ElementTree.fromstring(response.content)
-    
-    # Define namespace for Atom feed
-    namespace = {'atom': 'http://www.w3.org/2005/Atom'}
-    
-    image_links = []
-    # Use proper namespace to find entries
-    for entry in tree.findall('atom:entry', namespace):
-        image_link = entry.find('atom:image_link', namespace)
-        if image_link is not None:
-            image_links.append(image_link.text)
-    
+def parse_feed_and_get_images(feed_url, limit=None, offset=0):
+    # Only reads the feed up to offset + limit image links
+    image_links = (
+        image_link for _, image_link in iter_feed_entries(feed_url)
+        if image_link is not None
+    )
+    stop = offset + limit if limit is not None else None
+    image_links = list(islice(image_links, offset, stop))
+
     print(f"Found {len(image_links)} image links.")
-    return image_links
\ No newline at end of file
+    return image_links
+
+def iter_complete_entries(feed_url):
+    """Yield (product_id, image_link) pairs for entries that have both fields."""
+    for product_id, image_link in iter_feed_entries(feed_url):
+        if product_id is None or image_link is None:
+            continue
+        yield product_id, image_link
+
+def iter_source_entries(source):
+    """Complete (product_id, image_link) pairs from a feed URL or a local feed file."""
+    if os.path.isfile(source):
+        entries = iter_feed_stream(iter_cached_file(source))
+    else:
+        entries = iter_feed_entries(source)
+    return ((product_id, image_link) for product_id, image_link in entries if product_id and image_link)
+
+def iter_entry_chunks(feed_url, chunk_size):
+    """Group streamed complete entries into lists of at most chunk_size pairs."""
+    entries = iter_complete_entries(feed_url)
+    while True:
+        chunk = list(islice(entries, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def find_feed_image_link(feed_url, product_id):
+    """Image link of a single product, or None if the feed doesn't list it."""
+    for entry_id, image_link in iter_complete_entries(feed_url):
+        if entry_id == product_id:
+            return image_link
+    return None
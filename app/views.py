@@ -1,4 +1,6 @@
-from django.http import JsonResponse
+from django.http import JsonResponse, FileResponse, HttpResponse, HttpResponseNotModified, Http404, StreamingHttpResponse
+from django.conf import settings
+from django.urls import reverse
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, authenticate, logout
@@ -6,14 +8,25 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib import messages
 from .models import Frame
 from .forms import AddFrameForm, EditFrameForm, CustomUserCreationForm, DeleteConfirmationForm
-import json
+import os, hmac, json, logging
+from PIL import Image
 from .models import OutputImage
 from .utils import parse_feed_and_get_images
+from .rendering import frame_templates, render_fingerprint, thumbnail_bytes, thumbnail_name
+from .pipeline import render_output_once
+from .exporting import iter_zip, export_files, export_parts
+from .deletion import selected_outputs, delete_outputs
+from .listing import search_outputs, page_outputs, output_count, rendered_output_count, invalidate_output_count
+from .jobs import ACTIVE_STATUSES, start_job, claim_job, cancel_job, active_job, is_stale, is_resumable
+from .progress import finish_progress
+from .metrics import collect_worker_metrics, prometheus_text, stage_summary
 from django.shortcuts import get_object_or_404
 
+logger = logging.getLogger(__name__)
+
 @login_required
 def frame_list(request):
-    frames = Frame.objects.filter(owner=request.user)
+    frames = Frame.objects.filter(owner=request.user, deleting=False)
     return render(request, 'app/frame_list.html', {'frames': frames})
 
 def register(request):
@@ -62,8 +75,12 @@ def add_frame(request):
 @login_required
 def preview_frame(request, frame_id):
     frame = get_object_or_404(Frame, id=frame_id, owner=request.user)
+    if frame.has_local_feed:
+        messages.error(request, "This frame's feed is a local file; render it again with the render_feed command.")
+        return redirect('frame_detail', frame_id=frame.id)
     feed_url = frame.xmlFeedPath
-    image_links = parse_feed_and_get_images(feed_url)
+    # Only the first few entries are parsed; the rest come from feed_images_ajax
+    image_links = parse_feed_and_get_images(feed_url, limit=settings.PREVIEW_FEED_ENTRIES)
     first_image = image_links[0] if image_links else None
 
     if request.method == 'POST':
@@ -74,15 +91,33 @@ def preview_frame(request, frame_id):
                 frame.coordinates = coordinates
                 frame.save()
                 
-                # Start processing directly without checking existing outputs
+                if frame.render_mode == 'lazy':
+                    # Only register the products; each image renders on first request
+                    from .tasks import index_feed_entries
+                    try:
+                        index_feed_entries.delay(frame.id)
+                    except Exception:
+                        index_feed_entries(frame.id)
+                    messages.success(request, 'Coordinates saved! Outputs will be rendered on first request.')
+                    return redirect('frame_detail', frame_id=frame.id)
+
+                # One run per frame: the job row is the lock
+                job, created = start_job(frame)
+                if not created and is_stale(job):
+                    # Its worker died; the new run continues from its checkpoint
+                    created = claim_job(job)
+                if not created:
+                    messages.warning(request, 'Coordinates saved, but a render is already running for this frame. Cancel it and save again to render with the new coordinates.')
+                    return redirect('frame_detail', frame_id=frame.id)
+
                 try:
-                    from .tasks import process_feed_entries
-                    process_feed_entries.delay(frame.id)
+                    from .tasks import dispatch_run
+                    dispatch_run(job)
                     messages.success(request, 'Coordinates saved! Background processing started for all images.')
                 except Exception as e:
                     # Fallback: Sync processing
                     from .tasks import process_feed_entries
-                    process_feed_entries(frame.id)  # Run synchronously
+                    process_feed_entries(frame.id, job_id=job.id)  # Run synchronously
                     messages.success(request, 'Coordinates saved! Images processed synchronously.')
                     
                 return redirect('frame_detail', frame_id=frame.id)
@@ -97,12 +132,48 @@ def preview_frame(request, frame_id):
         'image_links': image_links
     })
 
+@login_required
+def feed_images_ajax(request, frame_id):
+    """Paginated product image links of the frame's feed for the preview page"""
+    frame = get_object_or_404(Frame, id=frame_id, owner=request.user)
+    if frame.has_local_feed:
+        return JsonResponse({'error': 'The feed is a local file'}, status=400)
+
+    try:
+        offset = max(0, int(request.GET.get('offset', 0)))
+        limit = min(max(1, int(request.GET.get('limit', settings.FEED_IMAGES_PAGE_SIZE))),
+                    settings.FEED_IMAGES_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid offset or limit'}, status=400)
+
+    # Fetch one extra link to know whether another page exists
+    image_links = parse_feed_and_get_images(frame.xmlFeedPath, limit=limit + 1, offset=offset)
+
+    return JsonResponse({
+        'offset': offset,
+        'limit': limit,
+        'images': image_links[:limit],
+        'has_more': len(image_links) > limit,
+    })
+
 @login_required
 def frame_detail(request, frame_id):
     """Frame detail page - Shows details and outputs of the given frame"""
     frame = get_object_or_404(Frame, id=frame_id, owner=request.user)
+    outputs_count = output_count(frame.id, frame.outputs.all())
+    parts = export_parts(rendered_output_count(frame)) if outputs_count else 1
+    
+    job = frame.jobs.first()
     
-    return render(request, 'app/frame_detail.html', {'frame': frame})
+    return render(request, 'app/frame_detail.html', {
+        'frame': frame,
+        'outputs_count': outputs_count,
+        'export_parts': range(1, parts + 1),
+        'job': job,
+        'job_active': job is not None and job.status in ACTIVE_STATUSES and not is_stale(job),
+        'job_resumable': job is not None and is_resumable(job),
+        'job_stages': stage_summary(job.metrics) if job is not None else [],
+    })
 
 @login_required
 def frame_outputs_ajax(request, frame_id):
@@ -112,34 +183,142 @@ def frame_outputs_ajax(request, frame_id):
     start = int(request.GET.get('start', 0))
     length = int(request.GET.get('length', 5))
     search_value = request.GET.get('search[value]', '')
+    # Cursor of this page, sent back by the client from the previous response
+    after = request.GET.get('after')
     
     # Filter outputs
-    outputs = frame.outputs.all()
-    if search_value:
-        # Search in the product_id field
-        outputs = outputs.filter(product_id__icontains=search_value)
+    outputs = search_outputs(frame.outputs.all(), search_value)
     
     # Pagination
-    total_records = outputs.count()
-    outputs = outputs[start:start + length]
+    total_records = output_count(frame.id, frame.outputs.all())
+    filtered_records = output_count(frame.id, outputs, search_value) if search_value else total_records
+    outputs, next_cursor = page_outputs(outputs, start, length, after)
     
     # Prepare data for DataTable
     data = []
     for output in outputs:
+        render_url = reverse('render_output', args=[frame.id, output.product_id])
+        if output.image:
+            image_url = output.image.url
+        elif frame.render_mode == 'lazy':
+            image_url = render_url
+        else:
+            image_url = ''
+        if output.thumbnail:
+            thumbnail_url = output.thumbnail.url
+        elif output.image:
+            # Older outputs get their thumbnail generated on first view
+            thumbnail_url = reverse('output_thumbnail', args=[output.id])
+        else:
+            thumbnail_url = ''
         data.append({
             'id': output.id,
             'product_id': output.product_id,
-            'image_url': output.image.url if output.image else '',
+            'image_url': image_url,
+            'thumbnail_url': thumbnail_url,
+            'render_url': render_url,
             'created_at': output.created_at.strftime('%Y-%m-%d %H:%M:%S'),
         })
     
     return JsonResponse({
         'draw': int(request.GET.get('draw', 1)),
         'recordsTotal': total_records,
-        'recordsFiltered': total_records,
+        'recordsFiltered': filtered_records,
+        'next_cursor': next_cursor,
         'data': data
     })
 
+@login_required
+def export_outputs(request, frame_id):
+    """Stream the frame's rendered outputs as a ZIP.
+
+    ?q= filters by product ID like the outputs table search. ?part=N exports
+    only the N-th block of ZIP_EXPORT_PART_SIZE outputs, so a very large
+    export can be fetched (and retried) in independent pieces.
+    """
+    frame = get_object_or_404(Frame, id=frame_id, owner=request.user)
+    outputs = frame.outputs.exclude(image='').order_by('id')
+    outputs = search_outputs(outputs, request.GET.get('q', ''))
+
+    filename = f"frame-{frame.id}-outputs"
+    part = request.GET.get('part')
+    if part:
+        try:
+            part = int(part)
+        except ValueError:
+            raise Http404('Invalid part')
+        size = settings.ZIP_EXPORT_PART_SIZE
+        if part < 1 or not size:
+            raise Http404('Invalid part')
+        outputs = outputs[(part - 1) * size:part * size]
+        filename += f"-part{part}"
+
+    response = StreamingHttpResponse(iter_zip(export_files(outputs)), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.zip"'
+    # Let nginx pass chunks through instead of buffering the whole archive
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def render_output(request, frame_id, product_id):
+    """Serve a single output, rendering it on first request (lazy mode).
+
+    Public like the media files themselves, so ad platforms can pull it.
+    An output is re-rendered when the frame image, coordinates or output
+    settings changed since it was produced. Only lazy frames render here,
+    and only products index_feed_entries registered; eager frames just
+    serve their finished outputs.
+    """
+    frame = get_object_or_404(Frame, id=frame_id, deleting=False)
+    if not frame.coordinates:
+        raise Http404('Frame has no coordinates yet')
+
+    output = OutputImage.objects.filter(frame=frame, product_id=product_id).first()
+    if output is None:
+        raise Http404('Product not found in feed')
+
+    render_hash = render_fingerprint(frame)
+    if not output.image or output.render_hash != render_hash or not os.path.exists(output.image.path):
+        if frame.render_mode != 'lazy':
+            raise Http404('Output not rendered')
+        image_link = output.product_image_url
+        try:
+            output = render_output_once(frame, product_id, image_link, render_hash)
+        except Exception as e:
+            logger.error(f"Lazy render of product {product_id} for frame {frame_id} failed: {e}")
+            return HttpResponse(status=502)
+        if output is None:
+            response = HttpResponse(status=503)
+            response['Retry-After'] = '5'
+            return response
+
+    etag = f'"{output.render_hash[:16]}-{output.source_hash[:16]}"'
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(output.image.open('rb'))
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={settings.LAZY_RENDER_MAX_AGE}'
+    return response
+
+@login_required
+def output_thumbnail(request, output_id):
+    """Create the thumbnail of an output rendered before thumbnails existed"""
+    output = get_object_or_404(OutputImage, id=output_id, frame__owner=request.user)
+    if not output.image:
+        raise Http404('Output has no image')
+
+    if not output.thumbnail:
+        with Image.open(output.image.path) as image:
+            thumbnail = thumbnail_bytes(image.convert('RGBA'))
+        thumb_name = thumbnail_name(output.frame_id, output.product_id)
+        os.makedirs(os.path.dirname(os.path.join(settings.MEDIA_ROOT, thumb_name)), exist_ok=True)
+        with open(os.path.join(settings.MEDIA_ROOT, thumb_name), 'wb') as f:
+            f.write(thumbnail)
+        output.thumbnail = thumb_name
+        output.save(update_fields=['thumbnail'])
+
+    return redirect(output.thumbnail.url)
+
 @login_required
 def delete_output(request, output_id):
     if request.method == 'POST':
@@ -147,10 +326,13 @@ def delete_output(request, output_id):
             output = get_object_or_404(OutputImage, id=output_id, frame__owner=request.user)
             product_id = output.product_id
             
-            # Delete the image file if it exists
+            # Delete the image files if they exist
             if output.image:
                 output.image.delete()
+            if output.thumbnail:
+                output.thumbnail.delete()
             output.delete()
+            invalidate_output_count(output.frame_id)
             
             return JsonResponse({
                 'success': True, 
@@ -160,6 +342,98 @@ def delete_output(request, output_id):
             return JsonResponse({'success': False, 'message': str(e)})
     return JsonResponse({'success': False, 'message': 'Invalid request method'})
 
+@login_required
+def bulk_delete_outputs(request, frame_id):
+    """Delete several outputs of a frame.
+
+    Expects a JSON body with either "ids" (output ids selected in the table)
+    or "all": true, optionally narrowed by "q" like the table search. Small
+    selections are deleted right away; larger ones are queued and report
+    progress over the frame's WebSocket.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'message': 'Invalid request method'})
+    frame = get_object_or_404(Frame, id=frame_id, owner=request.user)
+
+    try:
+        payload = json.loads(request.body or '{}')
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Invalid JSON body'}, status=400)
+
+    output_ids = payload.get('ids')
+    if payload.get('all'):
+        output_ids = None
+    elif not isinstance(output_ids, list) or not all(isinstance(i, int) for i in output_ids):
+        return JsonResponse({'success': False, 'message': 'Provide a list of output ids or "all"'}, status=400)
+    search_value = payload.get('q', '')
+
+    outputs = selected_outputs(frame.id, output_ids, search_value)
+    total = outputs.count()
+    if total <= settings.BULK_DELETE_INLINE_LIMIT:
+        deleted = delete_outputs(outputs)
+        invalidate_output_count(frame.id)
+        return JsonResponse({
+            'success': True,
+            'queued': False,
+            'deleted': deleted,
+            'message': f'{deleted} outputs deleted successfully'
+        })
+
+    from .tasks import delete_frame_outputs
+    delete_frame_outputs.delay(frame.id, output_ids, search_value)
+    return JsonResponse({
+        'success': True,
+        'queued': True,
+        'total': total,
+        'message': f'Deleting {total} outputs in the background'
+    })
+
+@login_required
+def cancel_render(request, frame_id):
+    """Stop the frame's active render run; finished outputs are kept."""
+    frame = get_object_or_404(Frame, id=frame_id, owner=request.user)
+    if request.method == 'POST':
+        job = active_job(frame)
+        if job is not None and cancel_job(job):
+            finish_progress(frame.id, {"cancelled": True, "processed": job.processed, "total": job.total})
+            messages.success(request, 'Render cancelled. You can resume it later.')
+        else:
+            messages.info(request, 'No render is running for this frame.')
+    return redirect('frame_detail', frame_id=frame.id)
+
+@login_required
+def resume_render(request, frame_id):
+    """Continue the frame's last interrupted run from its checkpoint."""
+    frame = get_object_or_404(Frame, id=frame_id, owner=request.user)
+    if request.method == 'POST':
+        job = frame.jobs.first()
+        if frame.has_local_feed:
+            messages.error(request, "This frame's feed is a local file; render it again with the render_feed command.")
+        elif job is None or not is_resumable(job):
+            messages.info(request, 'There is no interrupted render to resume.')
+        else:
+            from .tasks import resume_job
+            if resume_job(job):
+                messages.success(request, f'Render resumed from product {job.checkpoint} of {job.total}.')
+            else:
+                messages.warning(request, 'The render could not be resumed because another run is active.')
+    return redirect('frame_detail', frame_id=frame.id)
+
+def metrics(request):
+    """Render pipeline metrics of every worker, in Prometheus text format.
+
+    Scrapers authenticate with "Authorization: Bearer <METRICS_TOKEN>";
+    without a token configured only staff users may read the endpoint.
+    """
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), expected):
+            return HttpResponse(status=401)
+    elif not request.user.is_staff:
+        return HttpResponse(status=403)
+
+    return HttpResponse(prometheus_text(collect_worker_metrics()), content_type='text/plain; version=0.0.4')
+
 @login_required
 def edit_frame(request, frame_id):
     frame = get_object_or_404(Frame, id=frame_id, owner=request.user)
@@ -169,10 +443,13 @@ def edit_frame(request, frame_id):
         if form.is_valid():
             # Check if image was changed
             image_changed = 'image' in form.changed_data
+            old_image_path = Frame.objects.get(id=frame.id).image.path if image_changed else None
             
             form.save()
             
             if image_changed:
+                # Worker caches key on mtime, but drop this process's copy right away
+                frame_templates.invalidate(old_image_path)
                 messages.warning(request, f'Frame "{frame.name}" updated successfully! Note: You may need to re-set coordinates due to image change.')
             else:
                 messages.success(request, f'Frame "{frame.name}" updated successfully!')
@@ -196,28 +473,22 @@ def delete_frame(request, frame_id):
         # Simple POST handling without complex form validation
         frame_name = frame.name
         
-        # Delete all output images and their files
-        outputs = frame.outputs.all()
-        deleted_outputs = 0
-        for output in outputs:
-            if output.image:
-                try:
-                    output.image.delete()  # This deletes the file from filesystem
-                    deleted_outputs += 1
-                except:
-                    pass  # Continue even if file deletion fails
-        
-        # Delete frame image file
-        if frame.image:
-            try:
-                frame.image.delete()
-            except:
-                pass
-        
-        # Delete frame record (this will cascade delete all outputs due to ForeignKey)
-        frame.delete()
+        # Outputs and files are removed by a background task; hide the frame meanwhile
+        job = active_job(frame)
+        if job is not None:
+            cancel_job(job)
+        Frame.objects.filter(id=frame.id).update(deleting=True)
+        from .tasks import delete_frame_data
+        try:
+            delete_frame_data.delay(frame.id)
+        except Exception as e:
+            # Nothing will delete it, so show the frame again
+            logger.error(f"Could not queue deletion of frame {frame.id}: {e}")
+            Frame.objects.filter(id=frame.id).update(deleting=False)
+            messages.error(request, f'Frame "{frame_name}" could not be deleted right now. Please try again.')
+            return redirect('frame_detail', frame_id=frame.id)
         
-        messages.success(request, f'Frame "{frame_name}" and {deleted_outputs} output images have been deleted successfully.')
+        messages.success(request, f'Frame "{frame_name}" is being deleted together with its output images.')
         return redirect('frame_list')
     
     # If GET request, show confirmation page with a simple confirmation form
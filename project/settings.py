@@ -103,6 +103,109 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Feed rendering: number of products handled by each parallel Celery subtask
+RENDER_CHUNK_SIZE = int(os.getenv('RENDER_CHUNK_SIZE', '200'))
+
+# OutputImage rows are buffered and written with one bulk upsert per batch
+OUTPUT_WRITE_BATCH_SIZE = int(os.getenv('OUTPUT_WRITE_BATCH_SIZE', '100'))
+
+# Render pipeline: decode/composite/encode pool per worker process ('process' or 'thread';
+# 0 workers means one per CPU) and the bound on in-flight renders between stages
+RENDER_POOL = os.getenv('RENDER_POOL', 'process')
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', '0'))
+RENDER_QUEUE_SIZE = int(os.getenv('RENDER_QUEUE_SIZE', '16'))
+
+# Lazy rendering: lock TTL and how long concurrent requests wait for the first
+# render of the same product (seconds), and the Cache-Control max-age of served outputs
+LAZY_RENDER_LOCK_TIMEOUT = int(os.getenv('LAZY_RENDER_LOCK_TIMEOUT', '60'))
+LAZY_RENDER_WAIT = float(os.getenv('LAZY_RENDER_WAIT', '30'))
+LAZY_RENDER_MAX_AGE = int(os.getenv('LAZY_RENDER_MAX_AGE', '86400'))
+
+# Thumbnails generated next to every output for the frame detail DataTable
+THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', '160'))
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', '75'))
+
+# Render jobs: an active job without a heartbeat for this long is treated as
+# crashed and resumed (seconds), how often chunks poll for cancellation, and
+# how often a rendering chunk refreshes its job's heartbeat
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', '900'))
+JOB_CANCEL_CHECK_INTERVAL = float(os.getenv('JOB_CANCEL_CHECK_INTERVAL', '1.0'))
+JOB_HEARTBEAT_INTERVAL = float(os.getenv('JOB_HEARTBEAT_INTERVAL', '30'))
+
+# Render metrics endpoint (/metrics): bearer token for scrapers (empty = staff
+# users only), and how long a silent worker's totals are kept (seconds)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_RETENTION_SECONDS = int(os.getenv('METRICS_RETENTION_SECONDS', '86400'))
+
+# Outputs table: product ID search ('contains' or the cheaper 'prefix'), how
+# long output counts are cached (seconds) and where search counts stop
+OUTPUT_SEARCH_MODE = os.getenv('OUTPUT_SEARCH_MODE', 'contains')
+OUTPUT_COUNT_CACHE_SECONDS = int(os.getenv('OUTPUT_COUNT_CACHE_SECONDS', '60'))
+OUTPUT_SEARCH_COUNT_LIMIT = int(os.getenv('OUTPUT_SEARCH_COUNT_LIMIT', '10000'))
+
+# Outputs deleted per query by bulk deletions, and the largest selection the
+# bulk-delete API removes inline before handing it to a background task
+DELETE_BATCH_SIZE = int(os.getenv('DELETE_BATCH_SIZE', '1000'))
+BULK_DELETE_INLINE_LIMIT = int(os.getenv('BULK_DELETE_INLINE_LIMIT', '200'))
+
+# Outputs per ZIP when a frame's export is split into parts (0 = never split)
+ZIP_EXPORT_PART_SIZE = int(os.getenv('ZIP_EXPORT_PART_SIZE', '5000'))
+
+# Per-worker LRU cache of decoded frame templates, bounded by decoded size
+FRAME_TEMPLATE_CACHE_BYTES = int(os.getenv('FRAME_TEMPLATE_CACHE_BYTES', str(256 * 1024 * 1024)))
+
+# Shared on-disk feed cache: copies younger than the TTL (seconds) skip the network,
+# older ones are revalidated with ETag/If-Modified-Since
+FEED_CACHE_DIR = os.getenv('FEED_CACHE_DIR', str(MEDIA_ROOT / 'feed_cache'))
+FEED_CACHE_TTL = int(os.getenv('FEED_CACHE_TTL', '300'))
+
+# Shared on-disk cache of product image bytes (0 bytes disables it). Entries checked
+# within IMAGE_CACHE_FRESH_SECONDS are reused without a request, older ones revalidated
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', str(MEDIA_ROOT / 'image_cache'))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', str(5 * 1024 * 1024 * 1024)))
+IMAGE_CACHE_FRESH_SECONDS = int(os.getenv('IMAGE_CACHE_FRESH_SECONDS', '3600'))
+
+# Preview page: entries parsed up front and page size of the feed image endpoint
+PREVIEW_FEED_ENTRIES = int(os.getenv('PREVIEW_FEED_ENTRIES', '10'))
+FEED_IMAGES_PAGE_SIZE = int(os.getenv('FEED_IMAGES_PAGE_SIZE', '20'))
+
+# Product image fetching: thread pool size, per-host connection cap and timeouts (seconds)
+IMAGE_FETCH_CONCURRENCY = int(os.getenv('IMAGE_FETCH_CONCURRENCY', '8'))
+IMAGE_FETCH_PER_HOST = int(os.getenv('IMAGE_FETCH_PER_HOST', '4'))
+IMAGE_FETCH_CONNECT_TIMEOUT = float(os.getenv('IMAGE_FETCH_CONNECT_TIMEOUT', '5'))
+IMAGE_FETCH_READ_TIMEOUT = float(os.getenv('IMAGE_FETCH_READ_TIMEOUT', '30'))
+
+# Outbound fetch policy (feeds and images): per-host request rate per worker process
+# (requests/second, 0 = unlimited) and burst, retries of connection errors, 429 and
+# 5xx with exponential backoff (seconds), and the per-host circuit breaker
+IMAGE_FETCH_RATE = float(os.getenv('IMAGE_FETCH_RATE', '20'))
+IMAGE_FETCH_BURST = int(os.getenv('IMAGE_FETCH_BURST', '20'))
+FETCH_RETRIES = int(os.getenv('FETCH_RETRIES', '3'))
+FETCH_BACKOFF_BASE = float(os.getenv('FETCH_BACKOFF_BASE', '0.5'))
+FETCH_BACKOFF_MAX = float(os.getenv('FETCH_BACKOFF_MAX', '30'))
+FETCH_CIRCUIT_THRESHOLD = int(os.getenv('FETCH_CIRCUIT_THRESHOLD', '10'))
+FETCH_CIRCUIT_RESET_SECONDS = float(os.getenv('FETCH_CIRCUIT_RESET_SECONDS', '60'))
+
+# Hostile or broken feeds: byte caps of streamed image and feed downloads (0 = no cap),
+# the most pixels a product image may decode to (after JPEG draft scaling), and the
+# per-worker budget for images being decoded and rendered at once (0 = unlimited)
+IMAGE_MAX_BYTES = int(os.getenv('IMAGE_MAX_BYTES', str(25 * 1024 * 1024)))
+FEED_MAX_BYTES = int(os.getenv('FEED_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', str(40 * 1000 * 1000)))
+RENDER_MEMORY_BUDGET_BYTES = int(os.getenv('RENDER_MEMORY_BUDGET_BYTES', str(1024 * 1024 * 1024)))
+
+# Render progress is coalesced to one WebSocket message per N products or per interval (seconds)
+PROGRESS_EVERY_ITEMS = int(os.getenv('PROGRESS_EVERY_ITEMS', '50'))
+PROGRESS_INTERVAL = float(os.getenv('PROGRESS_INTERVAL', '0.5'))
+
+# Shared cache (progress counters etc. must be visible to every worker)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+}
+
 # Channels Configuration
 CHANNEL_LAYERS = {
     'default': {